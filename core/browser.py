@@ -1,35 +1,547 @@
 import os
+import copy
+import json
 import time
+import atexit
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import functools
 import shutil
-from DrissionPage import ChromiumPage, ChromiumOptions
-from pyvirtualdisplay import Display
-from .utils import download_video, clean_all_user_data, clean_all_chromium_data
+import socket
+import platform
+import threading
+from typing import Union
+from collections import deque
+from .utils import IO_EXECUTOR, move_to_trash
+from .session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+_IS_LINUX = platform.system() == 'Linux'
+# 直接使用 Chromium 原生 headless（--headless=new），Linux 上不再需要 Xvfb；
+# 未设置 BROWSER_HEADLESS 时，Linux 上既没有 DISPLAY 也没装 pyvirtualdisplay 就默认 headless
+_CAN_START_XVFB = not _IS_LINUX or bool(os.environ.get('DISPLAY')) or importlib.util.find_spec('pyvirtualdisplay') is not None
+_HEADLESS = os.environ.get('BROWSER_HEADLESS', '0' if _CAN_START_XVFB else '1') == '1'
+
+# 所有平台通用的启动参数
+_COMMON_ARGS = (
+    '--disable-background-networking',
+    '--disable-default-apps',
+    '--disable-extensions',
+    '--disable-sync',
+    '--disable-translate',
+    '--no-first-run',
+    '--disable-blink-features=AutomationControlled',
+    '--disable-infobars',
+    '--window-size=1920,1080',
+    # 关闭用不到的子系统，减少启动耗时和内存占用
+    '--disable-features=Translate,BackForwardCache,CalculateNativeWinOcclusion,MediaRouter,OptimizationHints',
+    '--disable-ipc-flooding-protection',
+    '--disable-breakpad',
+    '--disable-component-update',
+    '--no-default-browser-check',
+    '--mute-audio',
+    '--renderer-process-limit=2',
+)
+
+# Linux（Docker）额外需要的启动参数
+_LINUX_ARGS = (
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-dev-shm-usage',
+    '--disable-setuid-sandbox',  # 增加稳定性
+    '--no-zygote',               # 增加稳定性
+)
+
+# 查找QR码：优先 canvas，其次 base64 图片。一次调用返回位置、尺寸、截图区域 clip，
+# arguments[0] 为 true 时同时返回 base64 图片数据
+_FIND_QR_FN = """function findQr(withData) {
+    function clipOf(rect) {
+        return {x: rect.x + window.scrollX, y: rect.y + window.scrollY, width: rect.width, height: rect.height};
+    }
+    var canvases = document.querySelectorAll('canvas');
+    for (var canvas of canvases) {
+        if (canvas.width > 100 && canvas.height > 100) {
+            var rect = canvas.getBoundingClientRect();
+            var data = null;
+            if (withData) {
+                try {
+                    data = canvas.toDataURL('image/png').split('base64,')[1];
+                } catch(e) {
+                    // canvas可能被污染
+                    continue;
+                }
+            }
+            return {found: true, source: 'canvas', x: Math.round(rect.x), y: Math.round(rect.y),
+                    width: canvas.width, height: canvas.height, clip: clipOf(rect), data: data};
+        }
+    }
+    var imgs = document.querySelectorAll('img[src^="data:image"]');
+    for (var img of imgs) {
+        if (img.naturalWidth > 80 && img.src.indexOf('base64,') >= 0) {
+            var rect = img.getBoundingClientRect();
+            return {found: true, source: 'img', x: Math.round(rect.x), y: Math.round(rect.y),
+                    width: img.naturalWidth, height: img.naturalHeight, clip: clipOf(rect),
+                    data: withData ? img.src.split('base64,')[1] : null};
+        }
+    }
+    // 其他二维码容器/图片只能通过截图获取，不导出数据
+    var boxes = document.querySelectorAll('div[class*="qrcode"], div[class*="qr-"], img[alt*="qr"], img[src*="qrcode"]');
+    for (var box of boxes) {
+        var rect = box.getBoundingClientRect();
+        if (rect.width > 100 && rect.height > 100) {
+            return {found: true, source: box.tagName.toLowerCase(), x: Math.round(rect.x), y: Math.round(rect.y),
+                    width: Math.round(rect.width), height: Math.round(rect.height), clip: clipOf(rect), data: null};
+        }
+    }
+    return {found: false};
+}"""
+_FIND_QR_JS = _FIND_QR_FN + """
+    return findQr(arguments[0]);
+"""
+
+# 发布页元素定位器
+_SEL_IMAGE_TAB = 'text:图文'
+_SEL_UPLOAD = 'tag:input@type=file'
+_SEL_TITLE = '@@placeholder=填写标题'
+_SEL_DESC = '.ql-editor'
+_SEL_REUPLOAD = 'text:重新上传'
+_SEL_PUBLISH = 'text:发布'
+
+# 各发布类型的差异：需要切换的标签页，上传完成的标志（ready_text 出现且 busy_text 消失），
+# 以及脚本失败时兜底等待的元素 (定位器, 超时秒数)
+_PUBLISH_STRATEGIES = {
+    'image': {'tab': _SEL_IMAGE_TAB, 'ready_text': None, 'busy_text': '上传中', 'wait_for': (_SEL_PUBLISH, 60)},
+    'video': {'tab': None, 'ready_text': '重新上传', 'busy_text': '上传中', 'wait_for': (_SEL_REUPLOAD, 120)},
+}
+# 上传完成标志需连续保持的时间（毫秒），避免多张图片逐张上传的间隙被误判为完成
+_UPLOAD_SETTLE_MS = 1000
+
+# 登录页文字标记：账号登录模式 / 扫码登录模式
+_LOGIN_MARKERS = ('短信登录', '验证码登录')
+_SCAN_MARKERS = ('打开小红书', '扫一扫', '扫码登录')
+
+# 一次 JS 调用检查哪些文字出现在页面上，arguments[0] 为标记列表
+_FIND_MARKERS_JS = """
+    var text = document.body ? document.body.innerText : '';
+    return arguments[0].filter(function(m) { return text.indexOf(m) !== -1; });
+"""
+
+# 页面内等待工具：waitFor(check, timeoutMs) 返回 Promise，check() 返回真值时以该值 resolve，超时 resolve(null)。
+# DOM 变化后最多每 100ms 检查一次（不在每个 mutation 上读 innerText），另有 250ms 兜底检查
+# 覆盖属性/文字原地变化（如按钮 disabled 解除）。run_js 会等待 Promise（awaitPromise），调用方需传 timeout=
+_WAIT_FOR_JS = """
+    function waitFor(check, timeoutMs) {
+        return new Promise(function(resolve) {
+            var done = false, pending = false, observer, timer, ticker;
+            function finish(value) {
+                done = true;
+                observer.disconnect();
+                clearTimeout(timer);
+                clearInterval(ticker);
+                resolve(value);
+            }
+            function run() {
+                pending = false;
+                if (done) return;
+                var value = check();
+                if (value) finish(value);
+            }
+            function schedule() {
+                if (pending || done) return;
+                pending = true;
+                setTimeout(run, 100);
+            }
+            observer = new MutationObserver(schedule);
+            timer = setTimeout(function() { if (!done) finish(null); }, timeoutMs);
+            ticker = setInterval(run, 250);
+            observer.observe(document.documentElement, {childList: true, subtree: true});
+            run();
+        });
+    }
+"""
+
+# 在页面内等待上传完成且发布按钮可用后直接点击，一次 run_js 完成；返回 'clicked' 或 'timeout'。
+# arguments: [readyText, busyText, timeoutMs, settleMs]。发布按钮与 _SEL_PUBLISH 一致按文字匹配，
+# 不限标签，取文字为“发布”的最内层可见元素，自身或祖先带 disabled 时视为不可用
+_SUBMIT_PUBLISH_JS = _WAIT_FOR_JS + """
+    var readyText = arguments[0], busyText = arguments[1], timeoutMs = arguments[2], settleMs = arguments[3];
+    var readySince = null;
+    function publishButton() {
+        return [].find.call(document.querySelectorAll('button, [role="button"], div, span'), function(el) {
+            if (el.textContent.trim() !== '发布') return false;
+            if ([].some.call(el.children, function(c) { return c.textContent.trim() === '发布'; })) return false;
+            return el.getClientRects().length > 0 &&
+                !el.closest('[disabled], [aria-disabled="true"], [class*="disabled"]');
+        }) || null;
+    }
+    function uploaded() {
+        var text = document.body ? document.body.innerText : '';
+        return (!readyText || text.indexOf(readyText) !== -1) && (!busyText || text.indexOf(busyText) === -1);
+    }
+    return waitFor(function() {
+        if (!uploaded()) { readySince = null; return null; }
+        if (readySince === null) readySince = Date.now();
+        if (Date.now() - readySince < settleMs) return null;
+        return publishButton();
+    }, timeoutMs).then(function(el) {
+        if (!el) return 'timeout';
+        (el.closest('button, [role="button"]') || el).click();
+        return 'clicked';
+    });
+"""
+
+# 等待 arguments[0] 中任一文字出现，返回命中的标记列表（超时为空列表）；arguments[1] 为超时毫秒数
+_WAIT_FOR_MARKERS_JS = _WAIT_FOR_JS + """
+    var markers = arguments[0];
+    return waitFor(function() {
+        var text = document.body ? document.body.innerText : '';
+        var found = markers.filter(function(m) { return text.indexOf(m) !== -1; });
+        return found.length ? found : null;
+    }, arguments[1]).then(function(found) { return found || []; });
+"""
+
+# 在页面内依次点击各个偏移位置，每次点击后最多等待 arguments[3] 毫秒看QR码是否出现（判定与 _FIND_QR_JS 相同）
+# arguments: [x, y, offsets, waitMs]；返回 Promise，run_js 会等待其完成
+_CLICK_SWEEP_JS = _FIND_QR_FN + """
+    var x = arguments[0], y = arguments[1], offsets = arguments[2], waitMs = arguments[3];
+    function hasQr() {
+        return findQr(false).found;
+    }
+    return new Promise(function(resolve) {
+        var i = 0;
+        function next() {
+            if (i >= offsets.length) return resolve({found: false});
+            var tx = x + offsets[i][0], ty = y + offsets[i][1];
+            var el = document.elementFromPoint(tx, ty);
+            if (el) {
+                el.dispatchEvent(new MouseEvent('click', {bubbles: true, cancelable: true, view: window, clientX: tx, clientY: ty}));
+            }
+            var start = Date.now();
+            (function poll() {
+                if (hasQr()) return resolve({found: true, x: tx, y: ty, tag: el ? el.tagName : null});
+                if (Date.now() - start >= waitMs) { i++; return next(); }
+                setTimeout(poll, 50);
+            })();
+        }
+        next();
+    });
+"""
+
+# 页面就绪条件（供 _wait_until 在页面内等待）
+# 二维码已出现：与 _FIND_QR_JS 判定相同（canvas、base64 图片或二维码容器）
+_QR_READY = "(" + _FIND_QR_FN + ")(false).found"
+_PAGE_RENDERED = "document.readyState === 'complete' && document.body && document.body.innerText.length > 0"
+# 发布页：上传控件出现，或已被重定向到登录页
+_PUBLISH_PAGE_READY = (
+    "document.readyState === 'complete' && "
+    "(location.href.includes('login') || !!document.querySelector('input[type=file]'))"
+)
+
+# 扫码登录切换按钮的选择器（可用 QR_SWITCH_SELECTOR 覆盖），命中时无需分析布局和逐点点击
+_QR_SWITCH_SELECTOR = os.environ.get(
+    'QR_SWITCH_SELECTOR',
+    '[aria-label*="扫码"], [title*="扫码"], [class*="qrcode-switch"], [class*="qr-switch"]'
+)
+# 一次 run_js 完成：已有 canvas/base64 图片二维码直接返回；否则点击切换按钮并在页面内轮询，返回 findQr() 的结果。
+# 写成带参数的函数（DrissionPage 对以 function 开头的脚本直接按参数调用）；二维码容器的判定较宽松，
+# 命中它不能说明已在扫码模式，只在切换后超时时作为兜底结果返回
+_SWITCH_AND_FIND_QR_JS = """function(selector, waitMs) {
+    """ + _FIND_QR_FN + """
+    function exactQr() {
+        var hit = findQr(false);
+        return hit.found && (hit.source === 'canvas' || hit.source === 'img') ? hit : null;
+    }
+    var hit = exactQr();
+    if (hit) return hit;
+    var el = document.querySelector(selector);
+    if (!el) return {found: false};
+    el.click();
+    return new Promise(function(resolve) {
+        var start = Date.now();
+        (function poll() {
+            var result = exactQr();
+            if (result) return resolve(result);
+            if (Date.now() - start >= waitMs) return resolve(findQr(false));
+            setTimeout(poll, 50);
+        })();
+    });
+}"""
+
+# 上次点击扫描成功切换到扫码模式的坐标，登录页布局对所有用户相同，下次先直接点这里
+_qr_switch_point = None
+
+# QR图标点击的偏移位置（依次尝试）
+_QR_CLICK_OFFSETS = [(0, 0), (-10, 0), (-5, -5), (5, 5), (-10, -10)]
+
+# 反检测脚本，在每个新文档的页面脚本执行之前运行
+_STEALTH_JS = """
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
+    window.chrome = {runtime: {}};
+"""
+
+# 页面功能用不到的第三方字体和统计脚本
+_THIRD_PARTY_BLOCKED_URLS = ['*fonts.googleapis*', '*google-analytics*', '*googletagmanager*', '*sentry*']
+
+# 扫码登录只需要 DOM 和二维码 canvas，屏蔽图片/字体/视频以及第三方统计脚本以加快页面加载
+_BLOCKED_MEDIA_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.webp', '*.gif', '*.woff*', '*.ttf', '*.mp4',
+] + _THIRD_PARTY_BLOCKED_URLS
+
+# 对各站点发起不等待结果的 HEAD 请求，只为提前建立连接。
+# Chromium 把带凭据和不带凭据的请求放在不同的连接池，必须用 credentials: 'include'，随后的 page.get 导航才能复用这条连接
+_PRECONNECT_JS = """
+    arguments[0].forEach(function(origin) {
+        fetch(origin + '/', {method: 'HEAD', mode: 'no-cors', credentials: 'include'}).catch(function() {});
+    });
+"""
+
+# 登录状态验证结果的缓存时间（秒），Cookie 变化时立即失效
+_LOGIN_CACHE_TTL = 60
+
+# 调试登录页布局：开启后额外扫描页面上所有 SVG 并输出详细布局日志
+_DEBUG_LOGIN_LAYOUT = os.environ.get('DEBUG_LOGIN_LAYOUT') == '1'
+
+# 已生成的登录二维码在此时间（秒）内直接复用，服务端约 60 秒轮换一次
+_QR_CACHE_TTL = 25
+
+_DEFAULT_UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+_USERS_ROOT = os.path.abspath("data/users")
+
+
+# 调试端口池：浏览器启动时借出，close() 时归还，避免 auto_port 扫描以及并发启动抢同一端口
+_PORT_POOL = deque(range(9222, 9322))
+_PORT_LOCK = threading.Lock()
+
+
+def _acquire_port():
+    """从端口池取一个当前没有被占用的端口，池空或都被占用时返回 None"""
+    with _PORT_LOCK:
+        for _ in range(len(_PORT_POOL)):
+            port = _PORT_POOL.popleft()
+            # 端口上若有残留的浏览器，DrissionPage 会直接连上去，必须跳过
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                try:
+                    s.bind(('127.0.0.1', port))
+                    return port
+                except OSError:
+                    _PORT_POOL.append(port)
+    return None
+
+
+def _release_port(port):
+    if port is not None:
+        with _PORT_LOCK:
+            _PORT_POOL.append(port)
+
+
+# 所有 BrowserManager 共用一个 Xvfb（仅在 Linux 且没有 DISPLAY 时启动）
+_SHARED_DISPLAY = None
+_DISPLAY_LOCK = threading.Lock()
+
+
+def _ensure_display():
+    """启动共享虚拟显示器并写入 DISPLAY 环境变量，之后的调用直接复用"""
+    global _SHARED_DISPLAY
+    if not _IS_LINUX or _HEADLESS:
+        return
+    with _DISPLAY_LOCK:
+        if os.environ.get('DISPLAY'):
+            return
+        from pyvirtualdisplay import Display
+        _SHARED_DISPLAY = Display(visible=0, size=(1920, 1080))
+        _SHARED_DISPLAY.start()
+        display_num = _SHARED_DISPLAY.display
+        os.environ['DISPLAY'] = f':{display_num}'
+        atexit.register(_stop_display)
+        # 等待 Xvfb 的 socket 出现，最多 1 秒
+        socket_path = f'/tmp/.X11-unix/X{display_num}'
+        deadline = time.monotonic() + 1.0
+        while not os.path.exists(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        logger.info("🖥️ Started shared virtual display :%s", display_num)
+
+
+def _stop_display():
+    global _SHARED_DISPLAY
+    if _SHARED_DISPLAY:
+        try:
+            _SHARED_DISPLAY.stop()
+        except:
+            pass
+        _SHARED_DISPLAY = None
+
+
+# 所有用户共用一个 Chromium 进程，每个用户一个独立的 browser context（Cookie/存储互相隔离）。
+# 默认关闭（使用 BrowserPool 中的独立进程）；设置 BROWSER_SHARED=1 开启，BROWSER_SHARED_PORT 指定调试端口。
+# 暂不默认开启：共享进程崩溃或卡死时所有用户的会话同时丢失；context 销毁后登录态只能靠 session_store 恢复，
+# 而 _persist_cookies 只保存已验证登录的会话；多个账号共用同一进程指纹，尚未经过小红书风控的线上验证
+_SHARED_ENABLED = os.environ.get('BROWSER_SHARED', '0') == '1'
+_SHARED_PORT = int(os.environ.get('BROWSER_SHARED_PORT', '9333'))
+_SHARED_ROOT = os.path.abspath("data/shared")
+_shared_browser = None
+_shared_lock = threading.Lock()
+
+
+def _get_shared_browser():
+    """返回共享的 Chromium（首次调用或进程已退出时启动）"""
+    global _shared_browser
+    with _shared_lock:
+        if _shared_browser:
+            try:
+                _shared_browser.run_cdp('Browser.getVersion')
+                return _shared_browser
+            except Exception:
+                logger.warning("⚠️ Shared browser is gone, relaunching")
+                _shared_browser = None
+        
+        from DrissionPage import ChromiumPage
+        _ensure_display()
+        manager = BrowserManager('_shared', user_data_dir=_SHARED_ROOT)
+        manager._port = _SHARED_PORT
+        co = manager._get_options()
+        # 共享进程承载所有用户的标签页，放宽单实例的渲染进程上限
+        co.set_argument('--renderer-process-limit', os.environ.get('BROWSER_SHARED_RENDERERS', '8'))
+        _shared_browser = ChromiumPage(co)
+        logger.info("🌐 Shared browser started on port %s", _SHARED_PORT)
+        return _shared_browser
+
+
+_XHS_ORIGINS = ('https://www.xiaohongshu.com', 'https://creator.xiaohongshu.com')
+
+
+def _page_alive(page):
+    """用带短超时的 CDP 调用探测页面是否存活，避免在已失效的连接上等待默认超时"""
+    try:
+        page.run_cdp('Target.getTargetInfo', _timeout=0.5)
+        return True
+    except Exception:
+        return False
+
+
+def _clear_xhs_state(page):
+    """通过 CDP 清空浏览器 Cookie 和小红书站点存储，无需重启进程"""
+    page.run_cdp('Network.clearBrowserCookies')
+    for origin in _XHS_ORIGINS:
+        page.run_cdp('Storage.clearDataForOrigin', origin=origin, storageTypes='all')
+
+
+def _remove_files(paths):
+    for f in paths:
+        if os.path.exists(f):
+            try:
+                os.remove(f)
+            except:
+                pass
+
+# 清理 profile 时需要保留的文件/目录（cache 为 --disk-cache-dir 指定的 HTTP 缓存）
+_PROFILE_CACHE_DIR = 'cache'
+_PROFILE_KEEP = frozenset({'cookies.json', 'ua.txt', _PROFILE_CACHE_DIR})
+
+
+def _fast_profile_clean(user_data_dir, keep=_PROFILE_KEEP):
+    """
+    清空 Chromium profile，只保留 keep 中的文件。
+    子目录先原地改名（O(1)），再交给后台线程删除（move_to_trash），下次启动浏览器不必等待大量缓存文件被删完。
+    """
+    for entry in os.scandir(user_data_dir):
+        if entry.name not in keep:
+            move_to_trash(entry.path)
+
+
+# 新用户 profile 的模板目录（已完成首次启动初始化、未登录），设置 BROWSER_PROFILE_TEMPLATE 后启用
+_PROFILE_TEMPLATE = os.environ.get('BROWSER_PROFILE_TEMPLATE')
+_TEMPLATE_IGNORE = shutil.ignore_patterns('Singleton*', 'lockfile', '*.lock', 'cookies.json', 'ua.txt')
+
+
+def _seed_profile(user_data_dir):
+    """
+    profile 尚未初始化时从模板复制一份，省去 Chromium 首次启动创建 profile 的开销。
+    用普通复制而不是硬链接：Chromium 会原地改写 SQLite 等文件，硬链接会把改动写回模板。
+    """
+    if not _PROFILE_TEMPLATE or not os.path.isdir(_PROFILE_TEMPLATE):
+        return False
+    if os.path.exists(os.path.join(user_data_dir, 'Default')):
+        return False
+    shutil.copytree(_PROFILE_TEMPLATE, user_data_dir, ignore=_TEMPLATE_IGNORE, dirs_exist_ok=True)
+    return True
+
+
+_SAME_SITE = {'strict': 'Strict', 'lax': 'Lax', 'none': 'None', 'no_restriction': 'None'}
+
+
+def _to_cdp_cookie(cookie: dict) -> dict:
+    """把扩展/页面导出的 Cookie 转换为 CDP Network.setCookies 需要的格式"""
+    domain = cookie.get('domain') or '.xiaohongshu.com'
+    # 确保domain以.开头（除非是localhost）
+    if not domain.startswith('.') and 'localhost' not in domain:
+        domain = '.' + domain
+    
+    param = {
+        'name': cookie['name'],
+        'value': cookie.get('value', ''),
+        'domain': domain,
+        'path': cookie.get('path') or '/',
+    }
+    for key in ('secure', 'httpOnly'):
+        if key in cookie:
+            param[key] = bool(cookie[key])
+    
+    expires = cookie.get('expires', cookie.get('expirationDate'))
+    if expires and expires > 0:
+        param['expires'] = expires
+    
+    same_site = _SAME_SITE.get(str(cookie.get('sameSite', '')).lower())
+    # SameSite=None 必须搭配 Secure，否则 Chromium 会拒绝该 Cookie
+    if same_site and (same_site != 'None' or param.get('secure')):
+        param['sameSite'] = same_site
+    return param
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_cookies(cookies_json: str) -> tuple:
+    """解析 Cookie JSON 字符串为 CDP 格式，同一字符串只解析一次"""
+    return tuple(_to_cdp_cookie(c) for c in json.loads(cookies_json))
 
 class BrowserManager:
     """Manage Chromium browser instances for XHS operations"""
     
-    def __init__(self, user_id: str):
+    def __init__(self, user_id: str, user_data_dir: str = None, profile_dir: str = None):
         self.user_id = user_id
-        self.user_data_dir = os.path.abspath(f"data/users/{user_id}")
-        print(f"[{self.user_id}] 📁 Using user_data_dir: {self.user_data_dir}")
+        self.user_data_dir = user_data_dir or os.path.join(_USERS_ROOT, user_id)
+        logger.info("[%s] 📁 Using user_data_dir: %s", self.user_id, self.user_data_dir)
         os.makedirs(self.user_data_dir, exist_ok=True)
+        # Chromium profile 目录：默认就是用户目录；BrowserPool 的浏览器使用池自己的目录，换用户时不变
+        self.profile_dir = profile_dir or self.user_data_dir
         self.page = None
-        self.display = None
+        self._context_id = None  # 共享浏览器中该用户的 browser context
+        self._port = None  # 从 _PORT_POOL 借出的调试端口
+        self._proxy_url = None  # 当前浏览器启动时使用的代理
+        self._login_cache = None  # (cookie_hash, monotonic_ts, is_logged_in)
+        self._last_qr_scan = None  # (monotonic_ts, _find_qr 命中结果)
+        self._qr_cache = None  # (monotonic_ts, qr_base64)
+        self.use_count = 0  # 被 BrowserPool 借出的次数
 
-    def _get_options(self, proxy_url: str = None, user_agent: str = None, headless: bool = False):
+    @staticmethod
+    @functools.lru_cache(maxsize=2)
+    def _template_options(headless: bool):
+        """与用户无关的启动参数模板，每种 headless 模式只构建一次"""
+        from DrissionPage import ChromiumOptions
         co = ChromiumOptions()
         
-        import platform
-        if platform.system() == 'Linux':
+        if _IS_LINUX:
             co.set_browser_path('/usr/bin/chromium')
-            co.set_argument('--no-sandbox')
-            co.set_argument('--disable-gpu')
-            co.set_argument('--disable-dev-shm-usage')
-            co.set_argument('--disable-setuid-sandbox')  # 增加稳定性
-            co.set_argument('--no-zygote')               # 增加稳定性
+            for arg in _LINUX_ARGS:
+                co.set_argument(arg)
             
             if headless:
                 co.set_argument('--headless=new')
+                # 没有 X server 时也不需要 SwiftShader，二维码截图只用 2D canvas
+                co.set_argument('--disable-software-rasterizer')
             else:
                 co.headless(False)
         else:
@@ -39,388 +551,364 @@ class BrowserManager:
             else:
                 # co.headless(False) # Local dev default
                 pass
+        
+        co.set_user_agent(_DEFAULT_UA)
+        
+        for arg in _COMMON_ARGS:
+            co.set_argument(arg)
+        
+        return co
+
+    def _get_options(self, proxy_url: str = None, user_agent: str = None, headless: bool = _HEADLESS):
+        # 复制模板，只设置每次启动不同的字段
+        co = copy.deepcopy(self._template_options(headless))
             
         if proxy_url:
             co.set_proxy(proxy_url)
             
         if user_agent:
             co.set_user_agent(user_agent)
-        else:
-            co.set_user_agent("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
 
-        co.set_user_data_path(self.user_data_dir)
-        co.auto_port()
-        
-        co.set_argument('--disable-background-networking')
-        co.set_argument('--disable-default-apps')
-        co.set_argument('--disable-extensions')
-        co.set_argument('--disable-sync')
-        co.set_argument('--disable-translate')
-        co.set_argument('--no-first-run')
-        co.set_argument('--disable-blink-features=AutomationControlled')
-        co.set_argument('--disable-infobars')
-        co.set_argument('--window-size=1920,1080')
+        co.set_user_data_path(self.profile_dir)
+        # HTTP 缓存单独放在 profile 的 cache 目录，重置 profile 时保留，下次启动仍是热缓存
+        co.set_argument('--disk-cache-dir', os.path.join(self.profile_dir, _PROFILE_CACHE_DIR))
+        # 重启时沿用已借出的端口
+        if self._port is None:
+            self._port = _acquire_port()
+        if self._port is not None:
+            co.set_local_port(self._port)
+        else:
+            co.auto_port()
         
         return co
 
-    def start_browser(self, proxy_url: str = None, user_agent: str = None, clear_data: bool = True):
-        """Initialize browser session with fallback"""
+    def start_browser(self, proxy_url: str = None, user_agent: str = None, clear_data: bool = True, block_media: bool = False,
+                      inject_cookies: bool = True):
+        """Initialize browser session with fallback (inject_cookies=False skips restoring saved cookies, e.g. for QR login)"""
         
-        # 1. 尝试加载保存的 UA
-        ua_path = os.path.join(self.user_data_dir, "ua.txt")
-        if os.path.exists(ua_path):
-            try:
-                with open(ua_path, "r") as f:
-                    saved_ua = f.read().strip()
-                    if saved_ua:
-                        user_agent = saved_ua
-                        print(f"[{self.user_id}] 🍪 Loaded saved User-Agent")
-            except Exception as e:
-                print(f"[{self.user_id}] ⚠️ Failed to load saved UA: {e}")
+        # 1. 尝试加载保存的 UA（只读一次；profile 清理会保留 ua.txt，无需备份还原）
+        try:
+            with open(os.path.join(self.user_data_dir, "ua.txt"), "rb") as f:
+                saved_ua = f.read().decode("utf-8").strip()
+            if saved_ua:
+                user_agent = saved_ua
+                logger.info("[%s] 🍪 Loaded saved User-Agent", self.user_id)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Failed to load saved UA: %s", self.user_id, e)
 
         if clear_data:
-            if self.page:
-                try:
-                    self.page.quit()
-                except:
-                    pass
-                self.page = None
-            
-            if self.display:
-                try:
-                    self.display.stop()
-                except:
-                    pass
-                self.display = None
+            self.close()
             
-            if os.path.exists(self.user_data_dir):
+            if os.path.exists(self.profile_dir):
                 try:
-                    # 注意：如果我们要保留 cookie，可能不能完全删除 user_data_dir
-                    # 但 DrissionPage 的 user_data_dir 包含很多缓存，
-                    # 我们只需要保留 cookies.json 和 ua.txt
-                    # 所以先备份它们，清理后再放回去
-                    
-                    # 备份
-                    cookie_path = os.path.join(self.user_data_dir, "cookies.json")
-                    backup_cookies = None
-                    if os.path.exists(cookie_path):
-                        with open(cookie_path, "r") as f:
-                            backup_cookies = f.read()
-                            
-                    backup_ua = None
-                    if os.path.exists(ua_path):
-                        with open(ua_path, "r") as f:
-                            backup_ua = f.read()
-
-                    shutil.rmtree(self.user_data_dir)
-                    os.makedirs(self.user_data_dir, exist_ok=True)
-                    
-                    # 还原
-                    if backup_cookies:
-                        with open(cookie_path, "w") as f:
-                            f.write(backup_cookies)
-                    if backup_ua:
-                        with open(ua_path, "w") as f:
-                            f.write(backup_ua)
-                            
+                    # Chromium profile 包含很多缓存，只保留 cookies.json 和 ua.txt
+                    _fast_profile_clean(self.profile_dir)
                 except Exception as e:
-                    print(f"[{self.user_id}] ⚠️ Failed to clean user data directory: {e}")
+                    logger.warning("[%s] ⚠️ Failed to clean user data directory: %s", self.user_id, e)
         else:
             if self.page:
-                try:
-                    if self.page.url:
-                        return self.page
-                except:
-                    self.page = None
+                if _page_alive(self.page):
+                    return self.page
+                self.close()
         
-        os.makedirs(self.user_data_dir, exist_ok=True)
+        os.makedirs(self.profile_dir, exist_ok=True)
 
-        import platform
-        if platform.system() == 'Linux':
-            display_env = os.environ.get('DISPLAY')
-            if not display_env:
-                try:
-                    if self.display:
-                        self.display.stop()
-                except:
-                    pass
-                self.display = Display(visible=0, size=(1920, 1080))
-                self.display.start()
-                time.sleep(1)  # 等待 Xvfb 完全启动
-                print(f"[{self.user_id}] 🖥️ Started virtual display")
-            else:
-                print(f"[{self.user_id}] 🖥️ Using existing DISPLAY: {display_env}")
+        if _SHARED_ENABLED:
+            try:
+                return self._start_in_shared_browser(proxy_url, user_agent, block_media, inject_cookies)
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Shared browser unavailable, launching a dedicated one: %s", self.user_id, e)
+                self.close()
 
-        # 尝试启动浏览器 - 首先尝试非 headless 模式 (更隐蔽)
         try:
-            print(f"[{self.user_id}] 🚀 Starting new browser instance (Headless: False)...")
-            co = self._get_options(proxy_url, user_agent, headless=False)
+            if _seed_profile(self.profile_dir):
+                logger.info("[%s] 📋 Seeded profile from template", self.user_id)
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Failed to seed profile from template: %s", self.user_id, e)
+
+        if _IS_LINUX and not _HEADLESS:
+            _ensure_display()
+            logger.info("[%s] 🖥️ Using DISPLAY: %s", self.user_id, os.environ.get('DISPLAY'))
+
+        # DrissionPage 只在真正启动浏览器时才导入，仅做状态检查的进程无需加载
+        from DrissionPage import ChromiumPage
+
+        # 尝试启动浏览器 - 默认首先尝试非 headless 模式 (更隐蔽)，BROWSER_HEADLESS=1 时直接 headless
+        try:
+            logger.info("[%s] 🚀 Starting new browser instance (Headless: %s)...", self.user_id, _HEADLESS)
+            co = self._get_options(proxy_url, user_agent)
             self.page = ChromiumPage(co)
+            self._inject_stealth_scripts()
+            self._set_media_blocking(block_media)
+            self._preconnect()
             
             # 2. 注入保存的 Cookie
-            cookie_path = os.path.join(self.user_data_dir, "cookies.json")
-            if os.path.exists(cookie_path):
+            if inject_cookies:
                 try:
-                    import json
-                    with open(cookie_path, "r") as f:
-                        cookies = json.load(f)
-                    
-                    print(f"[{self.user_id}] 🍪 Injecting {len(cookies)} cookies...")
-                    # 必须先访问域名才能注入 cookie
-                    self.page.get("https://www.xiaohongshu.com", timeout=30)
-                    
-                    # DrissionPage set.cookies 接收 list 或 dict
-                    self.page.set.cookies(cookies)
-                    
-                    self.page.refresh()
-                    print(f"[{self.user_id}] ✅ Cookies injected successfully")
+                    self._inject_saved_cookies()
                 except Exception as e:
-                    print(f"[{self.user_id}] ⚠️ Failed to inject cookies: {e}")
+                    logger.warning("[%s] ⚠️ Failed to inject cookies: %s", self.user_id, e)
             
-            self._inject_stealth_scripts()
-            print(f"[{self.user_id}] ✅ Browser started successfully (Headless: False)")
+            self._proxy_url = proxy_url
+            logger.info("[%s] ✅ Browser started successfully (Headless: %s)", self.user_id, _HEADLESS)
             return self.page
         except Exception as e:
-            print(f"[{self.user_id}] ⚠️ Failed to start visible browser: {e}")
-            print(f"[{self.user_id}] 🔄 Falling back to headless mode...")
+            logger.warning("[%s] ⚠️ Failed to start visible browser: %s", self.user_id, e)
+            logger.info("[%s] 🔄 Falling back to headless mode...", self.user_id)
             
             # 失败回退到 headless 模式
             try:
                 co = self._get_options(proxy_url, user_agent, headless=True)
                 self.page = ChromiumPage(co)
+                self._inject_stealth_scripts()
+                self._set_media_blocking(block_media)
+                self._preconnect()
                 
-                # 重新定义 cookie_path（fallback 路径需要）
-                cookie_path = os.path.join(self.user_data_dir, "cookies.json")
                 # 同样尝试注入 Cookie
-                if os.path.exists(cookie_path):
+                if inject_cookies:
                     try:
-                        import json
-                        with open(cookie_path, "r") as f:
-                            cookies = json.load(f)
-                        self.page.get("https://www.xiaohongshu.com", timeout=30)
-                        self.page.set.cookies(cookies)
-                        self.page.refresh()
+                        self._inject_saved_cookies()
                     except:
                         pass
                 
-                self._inject_stealth_scripts()
-                print(f"[{self.user_id}] ✅ Browser started successfully (Headless: True)")
+                self._proxy_url = proxy_url
+                logger.info("[%s] ✅ Browser started successfully (Headless: True)", self.user_id)
                 return self.page
             except Exception as e2:
-                print(f"[{self.user_id}] ❌ Failed to start browser in both modes: {e2}")
+                logger.error("[%s] ❌ Failed to start browser in both modes: %s", self.user_id, e2)
                 raise e2
 
+    def _start_in_shared_browser(self, proxy_url: str = None, user_agent: str = None, block_media: bool = False,
+                                 inject_cookies: bool = True):
+        """在共享 Chromium 中新建一个隔离的 browser context 和标签页（代理按 context 设置）"""
+        browser = _get_shared_browser()
+        params = {'disposeOnDetach': False}
+        if proxy_url:
+            params['proxyServer'] = proxy_url
+        self._context_id = browser.run_cdp('Target.createBrowserContext', **params)['browserContextId']
+        target_id = browser.run_cdp('Target.createTarget', url='about:blank', browserContextId=self._context_id)['targetId']
+        self.page = browser.get_tab(target_id)
+        logger.info("[%s] 🌐 Opened tab in shared browser (context %s)", self.user_id, self._context_id)
+        
+        self._inject_stealth_scripts()
+        self._set_media_blocking(block_media)
+        try:
+            self.page.set.user_agent(user_agent or _DEFAULT_UA)
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Failed to set User-Agent: %s", self.user_id, e)
+        if inject_cookies:
+            try:
+                self._inject_saved_cookies()
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Failed to inject cookies: %s", self.user_id, e)
+        self._proxy_url = proxy_url
+        return self.page
+
+    def _reset_live_browser(self, proxy_url: str = None):
+        """
+        复用仍存活的浏览器：清空 Cookie 和站点存储后返回 page。
+        浏览器不存在、已失效或代理不同时返回 None，由调用方冷启动。
+        """
+        if not self.page or proxy_url != self._proxy_url:
+            return None
+        if not _page_alive(self.page):
+            logger.warning("[%s] ⚠️ Live browser not responding, relaunching", self.user_id)
+            self.close()
+            return None
+        try:
+            _clear_xhs_state(self.page)
+            logger.info("[%s] ♻️ Reusing live browser (cleared cookies/storage via CDP)", self.user_id)
+            return self.page
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Live browser unusable, relaunching: %s", self.user_id, e)
+            return None
+
+    def assign_user(self, user_id: str):
+        """
+        把池中的浏览器交给另一个用户：切换 user_data_dir（cookies.json/ua.txt 所在目录），
+        并清空上一个用户留在浏览器里的 Cookie 和站点存储。
+        """
+        self.user_id = user_id
+        self.user_data_dir = os.path.join(_USERS_ROOT, user_id)
+        os.makedirs(self.user_data_dir, exist_ok=True)
+        self._login_cache = None
+        self._last_qr_scan = None
+        self._qr_cache = None
+        
+        if self.page:
+            try:
+                _clear_xhs_state(self.page)
+                self.page.get('about:blank')
+            except Exception as e:
+                # 清理失败时不能把上一个用户的会话交出去
+                logger.warning("[%s] ⚠️ Failed to reset pooled browser, closing it: %s", self.user_id, e)
+                self.close()
+
+    def _inject_saved_cookies(self):
+        """注入 session_store 中保存的 Cookie"""
+        cookies = session_store.load(self.user_id)
+        if not cookies:
+            return
+        
+        # 兼容 sync-complete 保存的 {"cookies": [...]} 格式和 {name: value} 格式
+        if isinstance(cookies, dict):
+            cookies = cookies.get('cookies') if 'cookies' in cookies else [
+                {'name': k, 'value': v} for k, v in cookies.items()
+            ]
+        
+        logger.info("[%s] 🍪 Injecting %s cookies...", self.user_id, len(cookies))
+        # CDP 写入时带上 domain，不需要先打开站点再刷新，下一次导航即生效
+        self.page.run_cdp('Network.setCookies', cookies=[_to_cdp_cookie(c) for c in cookies])
+        logger.info("[%s] ✅ Cookies injected successfully", self.user_id)
+
+    def _preconnect(self):
+        """冷启动后立即对小红书站点发起 HEAD 请求（不等待结果），DNS/TLS 握手与后续启动步骤并行"""
+        try:
+            self.page.run_js(_PRECONNECT_JS, list(_XHS_ORIGINS))
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Preconnect failed: %s", self.user_id, e)
+
     def _inject_stealth_scripts(self):
-        """注入反检测脚本"""
+        """注入反检测脚本（对之后每次导航生效，且先于页面脚本执行）"""
         if not self.page:
             return
         
         try:
-            self.page.run_js("""
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
-                window.chrome = {runtime: {}};
-            """)
-            print(f"[{self.user_id}] 🛡️ Stealth scripts injected")
+            self.page.run_cdp('Page.addScriptToEvaluateOnNewDocument', source=_STEALTH_JS)
+            logger.info("[%s] 🛡️ Stealth scripts injected", self.user_id)
         except Exception as e:
-            print(f"[{self.user_id}] ⚠️ Failed to inject stealth scripts: {e}")
+            logger.warning("[%s] ⚠️ Failed to inject stealth scripts: %s", self.user_id, e)
 
-    def _get_cookies_dict(self):
+    def _set_media_blocking(self, enabled: bool, urls: list = _BLOCKED_MEDIA_URLS):
+        """通过 CDP 开启/关闭图片、字体、视频等请求的屏蔽（urls 为要屏蔽的 URL 模式）"""
         if not self.page:
-            return {}
+            return
+        try:
+            self.page.run_cdp('Network.enable')
+            self.page.run_cdp('Network.setBlockedURLs', urls=urls if enabled else [])
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Failed to set resource blocking: %s", self.user_id, e)
+
+    def _get_cookie_list(self):
+        if not self.page:
+            return []
         try:
-            cookies_list = self.page.cookies()
-            return {c['name']: c['value'] for c in cookies_list} if cookies_list else {}
+            return self.page.cookies() or []
         except:
-            return {}
+            return []
 
-    def _debug_page_layout(self):
+    def _probe_page(self):
         """
-        调试方法：输出页面布局信息
-        这是定位问题的关键！
+        一次 run_js 收集登录页布局信息并计算QR图标位置
+        （视口、'短信登录'位置、登录框、SVG 列表）
         """
         try:
-            # 1. 获取视口尺寸
-            viewport = self.page.run_js("""
-                return {
-                    innerWidth: window.innerWidth,
-                    innerHeight: window.innerHeight,
-                    scrollWidth: document.body.scrollWidth,
-                    scrollHeight: document.body.scrollHeight
+            info = self.page.run_js("""
+                var result = {
+                    viewport: {
+                        innerWidth: window.innerWidth,
+                        innerHeight: window.innerHeight,
+                        scrollWidth: document.body.scrollWidth,
+                        scrollHeight: document.body.scrollHeight
+                    },
+                    smsInfo: {found: false},
+                    loginBox: {found: false},
+                    qrPosition: {found: false, reason: 'login_box_not_found'},
+                    svgs: []
                 };
-            """)
-            print(f"[{self.user_id}] 📐 Viewport: {viewport}")
-            
-            # 2. 查找"短信登录"文字的位置
-            sms_info = self.page.run_js("""
-                (function() {
-                    var walker = document.createTreeWalker(
-                        document.body,
-                        NodeFilter.SHOW_TEXT,
-                        null,
-                        false
-                    );
-                    var node;
-                    while(node = walker.nextNode()) {
-                        if (node.textContent.includes('短信登录')) {
-                            var parent = node.parentElement;
-                            var rect = parent.getBoundingClientRect();
-                            return {
+                
+                // 1. 用原生 XPath 查找包含"短信登录"的最内层元素
+                var node = document.evaluate(
+                    "//*[contains(normalize-space(.),'短信登录')][not(.//*[contains(normalize-space(.),'短信登录')])]",
+                    document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+                ).singleNodeValue;
+                
+                if (node) {
+                    var rect = node.getBoundingClientRect();
+                    result.smsInfo = {
+                        found: true, text: '短信登录',
+                        x: Math.round(rect.x), y: Math.round(rect.y),
+                        width: Math.round(rect.width), height: Math.round(rect.height)
+                    };
+                    
+                    // 2. 向上查找登录框容器（调试用的宽松条件 / 定位图标用的严格条件）
+                    var parent = node;
+                    var box = null;
+                    for (var i = 0; i < 20 && parent; i++) {
+                        var r = parent.getBoundingClientRect();
+                        if (!result.loginBox.found && r.width > 300 && r.height > 300 && r.width < 800) {
+                            result.loginBox = {
                                 found: true,
-                                text: '短信登录',
-                                x: Math.round(rect.x),
-                                y: Math.round(rect.y),
-                                width: Math.round(rect.width),
-                                height: Math.round(rect.height)
+                                x: Math.round(r.x), y: Math.round(r.y),
+                                width: Math.round(r.width), height: Math.round(r.height),
+                                tag: parent.tagName,
+                                class: (parent.className || '').toString().substring(0, 50)
                             };
                         }
-                    }
-                    return {found: false};
-                })();
-            """)
-            print(f"[{self.user_id}] 📍 '短信登录' 位置: {sms_info}")
-            
-            # 3. 查找登录框容器
-            login_box = self.page.run_js("""
-                (function() {
-                    var walker = document.createTreeWalker(
-                        document.body,
-                        NodeFilter.SHOW_TEXT,
-                        null,
-                        false
-                    );
-                    var node;
-                    while(node = walker.nextNode()) {
-                        if (node.textContent.includes('短信登录')) {
-                            var parent = node.parentElement;
-                            // 向上查找直到找到足够大的容器
-                            for (var i = 0; i < 20 && parent; i++) {
-                                var rect = parent.getBoundingClientRect();
-                                if (rect.width > 300 && rect.height > 300 && rect.width < 800) {
-                                    return {
-                                        found: true,
-                                        x: Math.round(rect.x),
-                                        y: Math.round(rect.y),
-                                        width: Math.round(rect.width),
-                                        height: Math.round(rect.height),
-                                        tag: parent.tagName,
-                                        class: (parent.className || '').substring(0, 50)
-                                    };
-                                }
-                                parent = parent.parentElement;
-                            }
+                        // 登录框特征：宽度300-600，高度300-600
+                        if (!box && r.width > 300 && r.width < 700 && r.height > 300 && r.height < 700) {
+                            box = r;
                         }
+                        if (box && result.loginBox.found) break;
+                        parent = parent.parentElement;
                     }
-                    return {found: false};
-                })();
-            """)
-            print(f"[{self.user_id}] 📦 登录框容器: {login_box}")
-            
-            # 4. 查找所有 SVG 的位置
-            svgs = self.page.run_js("""
-                (function() {
-                    var svgs = document.querySelectorAll('svg');
-                    var results = [];
-                    for (var i = 0; i < svgs.length; i++) {
-                        var rect = svgs[i].getBoundingClientRect();
-                        if (rect.width > 5 && rect.height > 5) {
-                            results.push({
-                                index: i,
-                                x: Math.round(rect.x),
-                                y: Math.round(rect.y),
-                                width: Math.round(rect.width),
-                                height: Math.round(rect.height)
+                    
+                    // 3. QR图标在登录框右上角（向内偏移30像素）
+                    if (box) {
+                        result.qrPosition = {
+                            found: true,
+                            loginBox: {
+                                x: Math.round(box.x), y: Math.round(box.y),
+                                width: Math.round(box.width), height: Math.round(box.height),
+                                right: Math.round(box.right), bottom: Math.round(box.bottom)
+                            },
+                            qrIconPosition: {x: Math.round(box.right - 30), y: Math.round(box.top + 30)}
+                        };
+                    }
+                }
+                
+                // 4. 所有 SVG 的位置（仅调试时扫描）
+                var svgs = arguments[0] ? document.querySelectorAll('svg') : [];
+                if (svgs.length <= 500) {  // 超过 500 视为异常页面，放弃扫描
+                    // 先一次性读取所有布局信息，避免读写交替触发重排
+                    var rects = Array.prototype.map.call(svgs, function(el) {
+                        return el.getBoundingClientRect();
+                    });
+                    for (var j = 0; j < rects.length; j++) {
+                        var sr = rects[j];
+                        if (sr.width > 5 && sr.height > 5) {
+                            result.svgs.push({
+                                index: j,
+                                x: Math.round(sr.x), y: Math.round(sr.y),
+                                width: Math.round(sr.width), height: Math.round(sr.height)
                             });
                         }
                     }
-                    return results;
-                })();
-            """)
-            print(f"[{self.user_id}] 🎨 SVG 元素列表:")
-            for svg in svgs:
-                print(f"[{self.user_id}]    SVG[{svg['index']}]: ({svg['x']}, {svg['y']}) {svg['width']}x{svg['height']}")
+                }
+                return result;
+            """, _DEBUG_LOGIN_LAYOUT)
+            
+            if _DEBUG_LOGIN_LAYOUT:
+                logger.info("[%s] 📐 Viewport: %s", self.user_id, info['viewport'])
+                logger.info("[%s] 📍 '短信登录' 位置: %s", self.user_id, info['smsInfo'])
+                logger.info("[%s] 📦 登录框容器: %s", self.user_id, info['loginBox'])
+                logger.info("[%s] 🎨 SVG 元素列表:", self.user_id)
+                for svg in info['svgs']:
+                    logger.info("[%s]    SVG[%s]: (%s, %s) %sx%s", self.user_id, svg['index'], svg['x'], svg['y'], svg['width'], svg['height'])
+            logger.info("[%s] 🎯 QR图标位置计算结果: %s", self.user_id, info['qrPosition'])
             
             return {
-                'viewport': viewport,
-                'sms_info': sms_info,
-                'login_box': login_box,
-                'svgs': svgs
+                'viewport': info['viewport'],
+                'sms_info': info['smsInfo'],
+                'login_box': info['loginBox'],
+                'svgs': info['svgs'],
+                'qr_position': info['qrPosition']
             }
             
         except Exception as e:
-            print(f"[{self.user_id}] ⚠️ Debug layout failed: {e}")
-            return None
-
-    def _find_qr_icon_position(self):
-        """
-        动态查找QR图标的正确位置
-        基于登录框位置计算，而不是硬编码坐标
-        """
-        try:
-            # 方法1: 基于登录框位置计算QR图标位置
-            result = self.page.run_js("""
-                (function() {
-                    // 查找包含"短信登录"的元素，然后向上找登录框
-                    var walker = document.createTreeWalker(
-                        document.body,
-                        NodeFilter.SHOW_TEXT,
-                        null,
-                        false
-                    );
-                    var node;
-                    var loginBox = null;
-                    
-                    while(node = walker.nextNode()) {
-                        if (node.textContent.includes('短信登录')) {
-                            var parent = node.parentElement;
-                            for (var i = 0; i < 20 && parent; i++) {
-                                var rect = parent.getBoundingClientRect();
-                                // 登录框特征：宽度300-600，高度300-600
-                                if (rect.width > 300 && rect.width < 700 && 
-                                    rect.height > 300 && rect.height < 700) {
-                                    loginBox = parent;
-                                    break;
-                                }
-                                parent = parent.parentElement;
-                            }
-                            break;
-                        }
-                    }
-                    
-                    if (!loginBox) {
-                        return {found: false, reason: 'login_box_not_found'};
-                    }
-                    
-                    var boxRect = loginBox.getBoundingClientRect();
-                    
-                    // QR图标在登录框右上角
-                    // 计算右上角位置（向内偏移20-40像素）
-                    var qrIconX = boxRect.right - 30;
-                    var qrIconY = boxRect.top + 30;
-                    
-                    return {
-                        found: true,
-                        loginBox: {
-                            x: Math.round(boxRect.x),
-                            y: Math.round(boxRect.y),
-                            width: Math.round(boxRect.width),
-                            height: Math.round(boxRect.height),
-                            right: Math.round(boxRect.right),
-                            bottom: Math.round(boxRect.bottom)
-                        },
-                        qrIconPosition: {
-                            x: Math.round(qrIconX),
-                            y: Math.round(qrIconY)
-                        }
-                    };
-                })();
-            """)
-            
-            print(f"[{self.user_id}] 🎯 QR图标位置计算结果: {result}")
-            return result
-            
-        except Exception as e:
-            print(f"[{self.user_id}] ⚠️ Find QR icon position failed: {e}")
+            logger.warning("[%s] ⚠️ Page probe failed: %s", self.user_id, e)
             return None
 
     def _click_at_position(self, x, y):
@@ -449,46 +937,77 @@ class BrowserManager:
                     return {{clicked: false, reason: 'no_element_at_position'}};
                 }})();
             """)
-            print(f"[{self.user_id}] 🖱️ Click at ({x}, {y}): {result}")
+            logger.info("[%s] 🖱️ Click at (%s, %s): %s", self.user_id, x, y, result)
             return result
         except Exception as e:
-            print(f"[{self.user_id}] ⚠️ Click failed: {e}")
+            logger.warning("[%s] ⚠️ Click failed: %s", self.user_id, e)
             return None
 
+    def _wait_until(self, js_expr: str, timeout: float):
+        """在页面内等待 JS 条件表达式成立，成立时立即返回 True，超时返回 False"""
+        script = _WAIT_FOR_JS + f"return waitFor(function() {{ return !!({js_expr}); }}, arguments[0]).then(Boolean);"
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                return bool(self.page.run_js(script, int(remaining * 1000), timeout=remaining + 2))
+            except Exception:
+                # 等待期间发生跳转，旧文档的 Promise 随上下文销毁，在新文档上继续等
+                time.sleep(0.1)
+
+    def _wait_for_qr(self, timeout: float = 3.0):
+        """等待QR码出现（canvas、base64 图片或二维码容器），最多等待 timeout 秒"""
+        return self._wait_until(_QR_READY, timeout)
+
+    def _find_markers(self, markers):
+        """返回 markers 中当前出现在页面上的文字（一次 run_js）"""
+        try:
+            return self.page.run_js(_FIND_MARKERS_JS, list(markers)) or []
+        except Exception:
+            return []
+
+    def _wait_for_markers(self, markers, timeout: float = 15.0):
+        """在页面内等待任一文字标记出现，返回命中的标记列表（超时返回空列表）"""
+        try:
+            return self.page.run_js(_WAIT_FOR_MARKERS_JS, list(markers), int(timeout * 1000),
+                                    timeout=timeout + 2) or []
+        except Exception:
+            # 页面跳转导致上下文销毁时退回一次即时检查
+            return self._find_markers(markers)
+
+    def _find_qr(self, with_data: bool = False):
+        """
+        一次 JS 调用定位QR码（canvas 或 base64 图片），失败返回 {'found': False}。
+        500ms 内的命中结果会被复用，模式检测与截取之间不重复扫描。
+        """
+        if self._last_qr_scan:
+            scanned_at, result = self._last_qr_scan
+            if time.monotonic() - scanned_at < 0.5 and (result.get('data') or not with_data):
+                return result
+        try:
+            result = self.page.run_js(_FIND_QR_JS, with_data) or {'found': False}
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Find QR failed: %s", self.user_id, e)
+            return {'found': False}
+        # 只缓存命中结果，未找到时调用方需要继续轮询
+        self._last_qr_scan = (time.monotonic(), result) if result.get('found') else None
+        return result
+
     def _is_qr_mode(self):
         """检查是否已切换到QR码模式"""
         try:
             # 检查是否有 canvas（QR码用canvas渲染）
-            result = self.page.run_js("""
-                (function() {
-                    var canvases = document.querySelectorAll('canvas');
-                    for (var canvas of canvases) {
-                        if (canvas.width > 100 && canvas.height > 100) {
-                            var rect = canvas.getBoundingClientRect();
-                            return {
-                                found: true,
-                                x: Math.round(rect.x),
-                                y: Math.round(rect.y),
-                                width: canvas.width,
-                                height: canvas.height
-                            };
-                        }
-                    }
-                    return {found: false};
-                })();
-            """)
+            result = self._find_qr()
             
-            if result and result.get('found'):
-                print(f"[{self.user_id}] ✅ QR mode detected: canvas at {result}")
+            if result.get('found'):
+                logger.info("[%s] ✅ QR mode detected: %s at (%s, %s)", self.user_id, result['source'], result['x'], result['y'])
                 return True
             
             # 检查是否有扫码相关文字
-            has_scan_text = self.page.ele('text:打开小红书', timeout=1) or \
-                           self.page.ele('text:扫一扫', timeout=1) or \
-                           self.page.ele('text:扫码登录', timeout=1)
-            
-            if has_scan_text:
-                print(f"[{self.user_id}] ✅ QR mode detected: found scan text")
+            if self._find_markers(_SCAN_MARKERS):
+                logger.info("[%s] ✅ QR mode detected: found scan text", self.user_id)
                 return True
                 
             return False
@@ -496,180 +1015,212 @@ class BrowserManager:
             return False
 
     def _capture_qr_code(self):
-        """捕获QR码图片"""
-        try:
-            # 方法1: 从 canvas 获取
-            qr_data = self.page.run_js("""
-                (function() {
-                    var canvases = document.querySelectorAll('canvas');
-                    for (var canvas of canvases) {
-                        if (canvas.width > 100 && canvas.height > 100) {
-                            try {
-                                return canvas.toDataURL('image/png').split('base64,')[1];
-                            } catch(e) {
-                                // canvas可能被污染
-                            }
-                        }
-                    }
-                    return null;
-                })();
-            """)
+        """捕获QR码图片：canvas/base64 图片直接在页面内导出数据，其他元素用 CDP 截取所在区域"""
+        result = self._find_qr()
+        if result.get('source') in ('canvas', 'img'):
+            # toDataURL 直接读取 canvas 内容，不经过截图的光栅化和编码
+            exported = self._find_qr(with_data=True)
+            if exported.get('data'):
+                logger.info("[%s] ✅ Captured QR from %s via JS", self.user_id, exported['source'])
+                return exported['data']
+            # canvas 被污染无法导出时，改为截取扫描到的元素区域
+            if exported.get('found'):
+                result = exported
+        
+        clip = result.get('clip')
+        if clip and clip['width'] > 0 and clip['height'] > 0:
+            try:
+                shot = self.page.run_cdp('Page.captureScreenshot', format='png',
+                                         clip=dict(clip, scale=1), fromSurface=True)
+                logger.info("[%s] ✅ Captured QR from %s via clipped screenshot", self.user_id, result['source'])
+                return shot['data']
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Clipped screenshot failed: %s", self.user_id, e)
+        return None
+
+    def _click_qr_icon_with_mouse(self, click_x, click_y):
+        """备选方案：通过 CDP 派发真实的鼠标事件（移动、按下、抬起），逐个偏移位置点击QR图标"""
+        logger.info("[%s] 🖱️  Dispatching CDP mouse events at QR icon (%s, %s)...", self.user_id, click_x, click_y)
+        cdp = self.page.run_cdp
+        
+        for dx, dy in _QR_CLICK_OFFSETS:
+            target_x = click_x + dx
+            target_y = click_y + dy
             
-            if qr_data:
-                print(f"[{self.user_id}] ✅ Captured QR from canvas via JS")
-                return qr_data
+            logger.info("[%s] 🎯 Attempting click at (%s, %s)...", self.user_id, target_x, target_y)
             
-            # 方法2: 截取 canvas 元素
-            canvases = self.page.eles('tag:canvas')
-            for canvas in canvases:
-                try:
-                    size = canvas.rect.size
-                    if size[0] > 100 and size[1] > 100:
-                        qr_data = canvas.get_screenshot(as_base64=True)
-                        if qr_data:
-                            print(f"[{self.user_id}] ✅ Captured QR from canvas element")
-                            return qr_data
-                except Exception as e:
-                    print(f"[{self.user_id}] ⚠️ Canvas capture failed: {e}")
+            # Chrome 按顺序处理输入事件，不需要在 Python 侧停顿
+            cdp('Input.dispatchMouseEvent', type='mouseMoved', x=target_x, y=target_y)
+            cdp('Input.dispatchMouseEvent', type='mousePressed', x=target_x, y=target_y, button='left', clickCount=1)
+            cdp('Input.dispatchMouseEvent', type='mouseReleased', x=target_x, y=target_y, button='left', clickCount=1)
             
-            # 方法3: 查找 base64 图片
-            imgs = self.page.eles('tag:img')
-            for img in imgs:
-                try:
-                    src = img.attr('src') or ''
-                    if 'base64' in src:
-                        size = img.rect.size
-                        if size[0] > 80 and size[1] > 80:
-                            return src.split('base64,')[1]
-                except:
-                    continue
+            # 等待页面响应，QR码出现即返回
+            self._wait_for_qr(timeout=1.0)
             
+            # 检查是否成功切换
+            if self._is_qr_mode():
+                logger.info("[%s] ✅ Successfully switched to QR mode with mouse events!", self.user_id)
+                return True
+            logger.warning("[%s] ⚠️  QR mode not detected, trying next offset...", self.user_id)
+        return False
+
+    def _click_qr_switch(self):
+        """
+        按 _QR_SWITCH_SELECTOR 点击扫码切换按钮，没有命中时再点上次成功的坐标，
+        二维码出现则返回 True
+        """
+        try:
+            result = self.page.run_js(_SWITCH_AND_FIND_QR_JS, _QR_SWITCH_SELECTOR, 1000, timeout=5) or {}
+        except Exception:
+            result = {}
+        if result.get('found'):
+            # 命中结果交给 _find_qr 复用，模式检测和截取不必再扫描一次
+            self._last_qr_scan = (time.monotonic(), result)
+            logger.info("[%s] ✅ QR ready via selector switch (%s)", self.user_id, result['source'])
+            return True
+        if _qr_switch_point:
+            x, y = _qr_switch_point
+            try:
+                sweep = self.page.run_js(_CLICK_SWEEP_JS, x, y, [(0, 0)], 1000, timeout=5) or {}
+            except Exception:
+                sweep = {}
+            if sweep.get('found'):
+                logger.info("[%s] ✅ Switched to QR mode at cached position (%s, %s)", self.user_id, x, y)
+                return True
+        return False
+
+    def _cached_qr(self):
+        """浏览器仍停留在登录页且二维码未过期时返回缓存的二维码"""
+        if not self._qr_cache or not self.page:
             return None
-            
-        except Exception as e:
-            print(f"[{self.user_id}] ⚠️ Capture QR failed: {e}")
+        cached_at, qr_image = self._qr_cache
+        if time.monotonic() - cached_at >= _QR_CACHE_TTL:
+            return None
+        try:
+            if "login" not in self.page.url:
+                return None
+        except Exception:
             return None
+        return qr_image
 
-    def get_login_qrcode(self, proxy_url: str = None, user_agent: str = None):
+    def refresh_qr(self):
+        """丢弃缓存的二维码，下次 get_login_qrcode 重新生成"""
+        self._qr_cache = None
+
+    def get_login_qrcode(self, proxy_url: str = None, user_agent: str = None, force: bool = False):
         """
         获取登录二维码
+        force=True 时清空本用户的 profile 并冷启动；否则复用已有 profile（保留 HTTP 缓存），只清空登录态
         """
+        global _qr_switch_point
+        if force:
+            self.refresh_qr()
+        cached = self._cached_qr()
+        if cached:
+            logger.info("[%s] ♻️ Returning cached QR code", self.user_id)
+            return {"status": "waiting_scan", "qr_image": cached}
+        
         try:
-            clean_all_chromium_data(self.user_id)
-            users_base_dir = os.path.dirname(self.user_data_dir)
-            clean_all_user_data(users_base_dir, self.user_id)
-            
-            page = self.start_browser(proxy_url, user_agent, clear_data=True)
+            page = None if force else self._reset_live_browser(proxy_url)
+            if page:
+                self._set_media_blocking(True)
+            elif _SHARED_ENABLED:
+                # 共享浏览器每次都开全新的 browser context，不需要清理磁盘；登录页不注入已保存的 Cookie
+                self.close()
+                page = self.start_browser(proxy_url, user_agent, clear_data=False, block_media=True, inject_cookies=False)
+                logger.info("[%s] 🌐 Using fresh context in shared browser", self.user_id)
+            elif force or not os.path.exists(os.path.join(self.profile_dir, 'Default')):
+                # 只清空本用户的 profile（start_browser 的 clear_data）；全局 Chromium 目录和其他用户目录
+                # 可能正被池中其他浏览器使用，不能删除
+                self.close()
+                page = self.start_browser(proxy_url, user_agent, clear_data=True, block_media=True, inject_cookies=False)
+            else:
+                # 已有 profile：直接启动（不注入已保存的 Cookie），再通过 CDP 清掉 profile 里留下的 Cookie 和站点存储
+                self.close()
+                page = self.start_browser(proxy_url, user_agent, clear_data=False, block_media=True, inject_cookies=False)
+                _clear_xhs_state(page)
+                logger.info("[%s] ♻️ Reusing persistent profile (cleared cookies/storage via CDP)", self.user_id)
             
             # 导航到登录页
-            print(f"[{self.user_id}] 🌐 Navigating to login page...")
+            logger.info("[%s] 🌐 Navigating to login page...", self.user_id)
             page.get('https://creator.xiaohongshu.com/login', timeout=60)
             
-            print(f"[{self.user_id}] ⏳ Waiting for page to load...")
+            logger.info("[%s] ⏳ Waiting for page to load...", self.user_id)
             page.wait.doc_loaded(timeout=30)
             
-            # 等待关键元素出现 - 更鲁棒的等待策略
-            print(f"[{self.user_id}] 🔍 Waiting for login elements to render...")
-            time.sleep(5)  # 首先等待5秒让JS初始化
-            
-            # 尝试等待"短信登录"文字出现，最多重试3次
-            login_element_found = False
-            for attempt in range(3):
-                try:
-                    # 检查是否有"短信登录"或"验证码登录"文字
-                    sms_login = page.ele('text:短信登录', timeout=5) or page.ele('text:验证码登录', timeout=5)
-                    if sms_login:
-                        print(f"[{self.user_id}] ✅ Login element found!")
-                        login_element_found = True
-                        break
-                except:
-                    if attempt < 2:
-                        print(f"[{self.user_id}] ⚠️  Login element not found, retrying... (attempt {attempt+1}/3)")
-                        time.sleep(3)
-                    else:
-                        print(f"[{self.user_id}] ⚠️  Login element still not found after 3 attempts")
-            
-            # 额外等待确保页面完全渲染
-            time.sleep(2)
-            
-            self._inject_stealth_scripts()
+            # 等待"短信登录"/"验证码登录"（或已是扫码模式）文字出现
+            logger.info("[%s] 🔍 Waiting for login elements to render...", self.user_id)
+            markers = self._wait_for_markers(_LOGIN_MARKERS + _SCAN_MARKERS, timeout=20)
+            if markers:
+                logger.info("[%s] ✅ Login element found: %s", self.user_id, markers)
+            else:
+                logger.warning("[%s] ⚠️  Login element still not found after 20s", self.user_id)
             
-            print(f"[{self.user_id}] 📍 Current URL: {page.url}")
+            # 确保页面完全渲染
+            self._wait_until(_PAGE_RENDERED, 2)
             
-            # ========== 关键步骤：调试页面布局 ==========
-            print(f"[{self.user_id}] 🔍 Analyzing page layout...")
-            layout_info = self._debug_page_layout()
+            logger.info("[%s] 📍 Current URL: %s", self.user_id, page.url)
             
-            # ========== 动态计算QR图标位置 ==========
-            print(f"[{self.user_id}] 🎯 Finding QR icon position...")
-            qr_position = self._find_qr_icon_position()
+            # ========== 优先按选择器直接点击扫码切换按钮，找不到再走布局分析 + 点击扫描 ==========
+            layout_info = qr_position = None
+            switched = self._click_qr_switch()
+            if not switched:
+                # ========== 关键步骤：分析页面布局并动态计算QR图标位置 ==========
+                logger.info("[%s] 🔍 Analyzing page layout...", self.user_id)
+                layout_info = self._probe_page()
+                qr_position = layout_info.get('qr_position') if layout_info else None
             
-            if not qr_position or not qr_position.get('found'):
-                print(f"[{self.user_id}] ❌ Could not find login box, trying fallback...")
-                # 备选方案：基于视口尺寸估算
-                viewport = layout_info.get('viewport', {}) if layout_info else {}
-                width = viewport.get('innerWidth', 1920)
+                if not qr_position or not qr_position.get('found'):
+                    logger.error("[%s] ❌ Could not find login box, trying fallback...", self.user_id)
+                    # 备选方案：基于视口尺寸估算
+                    viewport = layout_info.get('viewport', {}) if layout_info else {}
+                    width = viewport.get('innerWidth', 1920)
                 
-                # 假设登录框在右侧 40% 区域
-                # 登录框宽度约 400px，右边距约 100px
-                estimated_x = width - 100 - 30  # 右边距-图标偏移
-                estimated_y = 200  # 假设距顶部 200px
+                    # 假设登录框在右侧 40% 区域
+                    # 登录框宽度约 400px，右边距约 100px
+                    estimated_x = width - 100 - 30  # 右边距-图标偏移
+                    estimated_y = 200  # 假设距顶部 200px
                 
-                print(f"[{self.user_id}] 📐 Using estimated position: ({estimated_x}, {estimated_y})")
-                qr_position = {
-                    'found': True,
-                    'qrIconPosition': {'x': estimated_x, 'y': estimated_y}
-                }
+                    logger.info("[%s] 📐 Using estimated position: (%s, %s)", self.user_id, estimated_x, estimated_y)
+                    qr_position = {
+                        'found': True,
+                        'qrIconPosition': {'x': estimated_x, 'y': estimated_y}
+                    }
             
             
-            # ========== 点击QR图标 (使用 Actions API 模拟真实鼠标) ==========
-            if qr_position and qr_position.get('found'):
-                click_x = qr_position['qrIconPosition']['x']
-                click_y = qr_position['qrIconPosition']['y']
-                
-                print(f"[{self.user_id}] 🖱️  Using Actions API to click QR icon at ({click_x}, {click_y})...")
-                
-                # 使用 Actions API 进行类人操作
-                from DrissionPage.common import Actions
-                ac = Actions(page)
+                # ========== 点击QR图标：先在页面内一次性扫过所有偏移位置 ==========
+                if qr_position and qr_position.get('found'):
+                    click_x = qr_position['qrIconPosition']['x']
+                    click_y = qr_position['qrIconPosition']['y']
                 
-                # 尝试多个偏移位置，使用真实的鼠标移动和点击
-                offsets = [(0, 0), (-10, 0), (-5, -5), (5, 5), (-10, -10)]
+                    logger.info("[%s] 🖱️  Sweeping synthetic clicks around QR icon at (%s, %s)...", self.user_id, click_x, click_y)
+                    try:
+                        sweep = page.run_js(_CLICK_SWEEP_JS, click_x, click_y, _QR_CLICK_OFFSETS, 600,
+                                            timeout=len(_QR_CLICK_OFFSETS) * 0.6 + 5) or {}
+                    except Exception as e:
+                        logger.warning("[%s] ⚠️  Click sweep failed: %s", self.user_id, e)
+                        sweep = {}
                 
-                for dx, dy in offsets:
-                    target_x = click_x + dx
-                    target_y = click_y + dy
-                    
-                    print(f"[{self.user_id}] 🎯 Attempting click at ({target_x}, {target_y})...")
-                    
-                    # 模拟真实鼠标移动：先移到附近，再移到目标
-                    ac.move_to((target_x - 50, target_y - 50))  # 移动到附近
-                    time.sleep(0.3)  # 短暂停顿
-                    ac.move_to((target_x, target_y))  # 移动到目标
-                    time.sleep(0.2)  # 短暂停顿
-                    ac.click()  # 点击
-                    
-                    time.sleep(2)  # 等待2秒让页面响应
-                    
-                    # 检查是否成功切换
-                    if self._is_qr_mode():
-                        print(f"[{self.user_id}] ✅ Successfully switched to QR mode with Actions API!")
-                        break
+                    if sweep.get('found'):
+                        logger.info("[%s] ✅ Switched to QR mode via click sweep at (%s, %s)", self.user_id, sweep['x'], sweep['y'])
+                        _qr_switch_point = (sweep['x'], sweep['y'])
                     else:
-                        print(f"[{self.user_id}] ⚠️  QR mode not detected, trying next offset...")
+                        # 合成点击无效时退回到 CDP 真实鼠标事件
+                        self._click_qr_icon_with_mouse(click_x, click_y)
             
             # ========== 等待QR码渲染 ==========
-            time.sleep(3)  # 增加等待时间确保二维码完全加载
+            self._wait_for_qr(timeout=3.0)
                 
             # ========== 捕获QR码 ==========
             if self._is_qr_mode():
                 qr_image = self._capture_qr_code()
                 if qr_image:
-                    print(f"[{self.user_id}] ✅ QR code captured successfully")
+                    logger.info("[%s] ✅ QR code captured successfully", self.user_id)
+                    self._qr_cache = (time.monotonic(), qr_image)
                     return {"status": "waiting_scan", "qr_image": qr_image}
             
             # 备选：返回全页面截图
-            print(f"[{self.user_id}] ⚠️ QR not found, returning full page screenshot")
+            logger.warning("[%s] ⚠️ QR not found, returning full page screenshot", self.user_id)
             
             # 截取视口（而不是整个页面）
             base64_str = page.get_screenshot(as_base64=True, full_page=False)
@@ -684,9 +1235,7 @@ class BrowserManager:
             }
                 
         except Exception as e:
-            print(f"[{self.user_id}] ❌ Error getting QR: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("[%s] ❌ Error getting QR: %s", self.user_id, e)
             
             if self.page:
                 try:
@@ -696,58 +1245,79 @@ class BrowserManager:
                     pass
             return {"status": "error", "msg": str(e)}
 
+    async def get_login_qrcode_async(self, proxy_url: str = None, user_agent: str = None, force: bool = False):
+        """get_login_qrcode 的异步版本，在线程中执行阻塞的浏览器操作"""
+        return await asyncio.to_thread(self.get_login_qrcode, proxy_url, user_agent, force)
+
     def check_login_status(self):
-        """检查登录状态"""
+        """检查登录状态（Cookie 未变化时 60 秒内直接复用上次验证结果）"""
         if not self.page:
             return False
             
         try:
-            cookies_dict = self._get_cookies_dict()
-            
-            # 只有 web_session 才是真正的登录凭证
-            if 'web_session' in cookies_dict:
-                print(f"[{self.user_id}] 🍪 Found web_session cookie, verifying validity...")
-                # 不要直接返回 True，而是去访问页面验证
-                try:
-                    if "creator" not in self.page.url:
-                        self.page.get("https://creator.xiaohongshu.com/creator/home", timeout=15)
-                    
-                    # 检查是否被重定向回登录页
-                    if "login" in self.page.url:
-                        print(f"[{self.user_id}] ❌ Cookie invalid: Redirected to login page")
-                        return False
-                        
-                    if "creator" in self.page.url:
-                        print(f"[{self.user_id}] ✅ Verified login via URL check")
-                        return True
-                except Exception as e:
-                    print(f"[{self.user_id}] ⚠️ Verification navigation failed: {e}")
-                    return False
-            
-            # 如果只有 a1，尝试验证是否真的登录了
-            if 'a1' in cookies_dict:
-                try:
-                    # 只有在当前不在 creator 页面时才跳转，避免刷新页面
-                    if "creator" not in self.page.url:
-                        self.page.get("https://creator.xiaohongshu.com/creator/home", timeout=15)
-                    
-                    if "creator" in self.page.url and "login" not in self.page.url:
-                        print(f"[{self.user_id}] ✅ Verified login via URL check")
-                        return True
-                except:
-                    pass
-                # 如果跳转失败或 URL 不对，说明只有 a1 但没登录
+            cookies_list = self._get_cookie_list()
+            cookie_pairs = sorted((c['name'], c['value']) for c in cookies_list)
+            cookie_hash = hashlib.blake2b(str(cookie_pairs).encode(), digest_size=8).digest()
             
-            if "creator/home" in self.page.url:
-                return True
+            if self._login_cache:
+                cached_hash, cached_at, cached_result = self._login_cache
+                if cached_hash == cookie_hash and time.monotonic() - cached_at < _LOGIN_CACHE_TTL:
+                    return cached_result
             
-            if self.page.ele('text:发布笔记', timeout=1):
-                return True
-                
-            return False
+            result = self._verify_login(cookies_list)
+            if result is None:
+                return False
+            self._login_cache = (cookie_hash, time.monotonic(), result)
+            return result
         except Exception as e:
-            print(f"[{self.user_id}] ⚠️ Check login error: {e}")
+            logger.warning("[%s] ⚠️ Check login error: %s", self.user_id, e)
             return False
+
+    def _verify_login(self, cookies_list):
+        """通过页面跳转验证登录状态，验证过程出错时返回 None"""
+        navigated = False
+        # 只有 web_session 才是真正的登录凭证
+        if any(c['name'] == 'web_session' for c in cookies_list):
+            logger.info("[%s] 🍪 Found web_session cookie, verifying validity...", self.user_id)
+            # 不要直接返回 True，而是去访问页面验证
+            try:
+                if "creator" not in self.page.url:
+                    self.page.get("https://creator.xiaohongshu.com/creator/home", timeout=15)
+                    navigated = True
+                
+                # 检查是否被重定向回登录页
+                if "login" in self.page.url:
+                    logger.error("[%s] ❌ Cookie invalid: Redirected to login page", self.user_id)
+                    return False
+                    
+                if "creator" in self.page.url:
+                    logger.info("[%s] ✅ Verified login via URL check", self.user_id)
+                    return True
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Verification navigation failed: %s", self.user_id, e)
+                return None
+        
+        # 如果只有 a1，尝试验证是否真的登录了
+        if any(c['name'] == 'a1' for c in cookies_list):
+            try:
+                # 只有在当前不在 creator 页面且本次还没跳转过时才跳转，避免重复加载页面
+                if "creator" not in self.page.url and not navigated:
+                    self.page.get("https://creator.xiaohongshu.com/creator/home", timeout=15)
+                
+                if "creator" in self.page.url and "login" not in self.page.url:
+                    logger.info("[%s] ✅ Verified login via URL check", self.user_id)
+                    return True
+            except:
+                pass
+            # 如果跳转失败或 URL 不对，说明只有 a1 但没登录
+        
+        if "creator/home" in self.page.url:
+            return True
+        
+        if self._find_markers(('发布笔记',)):
+            return True
+            
+        return False
     
     def get_cookies(self):
         if not self.page:
@@ -758,79 +1328,123 @@ class BrowserManager:
             return None
 
     def close(self):
+        # 已登录用户的 Cookie 先写回 session_store：context 销毁或池中的 profile 被清空后，下次启动靠它恢复
         if self.page:
+            self._persist_cookies()
+
+        # 共享浏览器：销毁该用户的 context（连同其中的标签页和 Cookie），不退出进程
+        if self._context_id:
             try:
-                self.page.quit()
-            except:
-                pass
+                _shared_browser.run_cdp('Target.disposeBrowserContext', browserContextId=self._context_id)
+            except Exception as e:
+                logger.warning("[%s] ⚠️ Failed to dispose browser context: %s", self.user_id, e)
+            self._context_id = None
             self.page = None
-        if self.display:
+        
+        if self.page:
             try:
-                self.display.stop()
+                self.page.quit()
             except:
                 pass
-            self.display = None
+            self.page = None
+        _release_port(self._port)
+        self._port = None
+
+    def reset_for_reuse(self):
+        """
+        BrowserPool 回收浏览器前调用：保存已登录用户的 Cookie，清空 Cookie/站点存储和请求屏蔽并回到空白页。
+        浏览器未启动、已失效、带代理（代理是进程级参数）或位于共享浏览器 context 中时返回 False，由调用方关闭。
+        """
+        if not self.page or self._context_id or self._proxy_url or not _page_alive(self.page):
+            return False
+        self._persist_cookies()
+        try:
+            _clear_xhs_state(self.page)
+            self.page.run_cdp('Network.setBlockedURLs', urls=[])
+            self.page.get('about:blank')
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Failed to reset browser for reuse: %s", self.user_id, e)
+            return False
+        self._login_cache = None
+        self._last_qr_scan = None
+        self._qr_cache = None
+        return True
+
+    def _persist_cookies(self):
+        """
+        已验证登录时把当前 Cookie 写回 session_store：共享浏览器的 context 销毁、池中浏览器被清空后 Cookie 随之丢失，
+        下次启动由 _inject_saved_cookies 恢复。未登录时不写，避免覆盖已保存的有效 Cookie。
+        """
+        if not self._login_cache or not self._login_cache[2]:
+            return
+        try:
+            cookies = self.page.cookies(all_domains=True, all_info=True) or []
+            cookies = [c for c in cookies if 'xiaohongshu' in c.get('domain', '')]
+            if cookies:
+                session_store.save(self.user_id, cookies)
+                logger.info("[%s] 💾 Persisted %s cookies", self.user_id, len(cookies))
+        except Exception as e:
+            logger.warning("[%s] ⚠️ Failed to persist cookies: %s", self.user_id, e)
+
+    async def check_login_status_async(self):
+        """check_login_status 的异步版本"""
+        return await asyncio.to_thread(self.check_login_status)
 
     def cleanup_user_data(self):
-        if os.path.exists(self.user_data_dir):
-            try:
-                shutil.rmtree(self.user_data_dir)
-            except:
-                pass
+        """删除用户目录：先原地改名腾出路径，再交给后台线程删除，不阻塞调用方"""
+        try:
+            move_to_trash(self.user_data_dir)
+        except OSError as e:
+            logger.warning("[%s] ⚠️ Failed to remove user data directory: %s", self.user_id, e)
 
-    def publish_content(self, cookies: str, publish_type: str, files: list, title: str, desc: str, proxy_url: str = None, user_agent: str = None):
-        """发布内容"""
+    def publish_content(self, cookies: Union[str, list], publish_type: str, files: list, title: str, desc: str, proxy_url: str = None, user_agent: str = None):
+        """发布内容（不关闭浏览器，调用方负责释放）"""
         try:
+            strategy = _PUBLISH_STRATEGIES.get(publish_type)
+            if strategy is None:
+                raise Exception(f"Unsupported publish_type: {publish_type}")
             page = self.start_browser(proxy_url, user_agent, clear_data=False)
-            page.get("https://creator.xiaohongshu.com")
+            # 导航和登录验证阶段不需要图片/字体，上传前再放开图片
+            self._set_media_blocking(True)
             
+            # Cookie 在第一次导航之前通过 CDP 写入（带 domain），无需先打开站点再刷新
             if cookies:
                 try:
+                    # 确保每个 cookie 都有必要的字段，并转换为 CDP 格式
                     if isinstance(cookies, str):
-                        import json
-                        cookies_obj = json.loads(cookies)
+                        cookies_obj = _parse_cookies(cookies)
                     else:
-                        cookies_obj = cookies
-                    
-                    print(f"[{self.user_id}] 🍪 Received {len(cookies_obj)} cookies")
-                    print(f"[{self.user_id}] 📝 Cookie names: {[c.get('name') for c in cookies_obj[:10]]}")  # 只打印前10个
+                        cookies_obj = tuple(_to_cdp_cookie(c) for c in cookies)
                     
-                    # 确保每个 cookie 都有必要的字段
-                    for cookie in cookies_obj:
-                        if 'domain' not in cookie or not cookie['domain']:
-                            cookie['domain'] = '.xiaohongshu.com'
-                        # 确保domain以.开头（除非是localhost）
-                        if not cookie['domain'].startswith('.') and 'localhost' not in cookie['domain']:
-                            cookie['domain'] = '.' + cookie['domain']
+                    logger.info("[%s] 🍪 Received %s cookies", self.user_id, len(cookies_obj))
+                    logger.info("[%s] 📝 Cookie names: %s", self.user_id, [c['name'] for c in cookies_obj[:10]])  # 只打印前10个
                     
-                    page.set.cookies(cookies_obj)
-                    print(f"[{self.user_id}] 🍪 Injected cookies, waiting for page to settle...")
-                    time.sleep(2)
-                    page.refresh()
-                    time.sleep(5)  # 给更多时间让页面完全加载
+                    # 一次 CDP 调用批量写入所有 Cookie
+                    page.run_cdp('Network.setCookies', cookies=list(cookies_obj))
+                    logger.info("[%s] 🍪 Injected cookies", self.user_id)
                 except Exception as e:
-                    print(f"[{self.user_id}] ⚠️ Error setting cookies: {e}")
+                    logger.warning("[%s] ⚠️ Error setting cookies: %s", self.user_id, e)
 
             # 更robust的登录检测：尝试访问发布页面
-            print(f"[{self.user_id}] 🔍 Verifying login by navigating to publish page...")
+            logger.info("[%s] 🔍 Verifying login by navigating to publish page...", self.user_id)
             try:
                 page.get('https://creator.xiaohongshu.com/publish/publish', timeout=15)
-                time.sleep(3)
+                self._wait_until(_PUBLISH_PAGE_READY, 5)
                 
                 # 如果被重定向到登录页，说明Cookie无效
                 if "login" in page.url:
-                    print(f"[{self.user_id}] ❌ Redirected to login page, cookies invalid")
+                    logger.error("[%s] ❌ Redirected to login page, cookies invalid", self.user_id)
                     raise Exception("Cookie expired or not logged in")
                 
                 # 如果成功到达发布页，说明已登录
                 if "publish" in page.url:
-                    print(f"[{self.user_id}] ✅ Successfully reached publish page, login verified")
+                    logger.info("[%s] ✅ Successfully reached publish page, login verified", self.user_id)
                 else:
                     # 其他未预期的页面
-                    print(f"[{self.user_id}] ⚠️ Unexpected page: {page.url}")
+                    logger.warning("[%s] ⚠️ Unexpected page: %s", self.user_id, page.url)
                     # 再试一次跳转
                     page.get('https://creator.xiaohongshu.com/publish/publish', timeout=15)
-                    time.sleep(2)
+                    self._wait_until(_PUBLISH_PAGE_READY, 5)
                     
                     if "login" in page.url:
                         raise Exception("Cookie expired or not logged in")
@@ -838,41 +1452,64 @@ class BrowserManager:
             except Exception as e:
                 if "Cookie expired" in str(e):
                     raise
-                print(f"[{self.user_id}] ⚠️ Navigation error: {e}, attempting to continue...")
+                logger.warning("[%s] ⚠️ Navigation error: %s, attempting to continue...", self.user_id, e)
                 # 如果导航失败，再次尝试
                 page.get('https://creator.xiaohongshu.com/publish/publish')
-                time.sleep(3)
+                self._wait_until(_PUBLISH_PAGE_READY, 5)
             
-            if publish_type == 'image':
+            if strategy['tab']:
                 try:
-                    image_tab = self.page.ele('text:图文', timeout=5)
-                    if image_tab:
-                        image_tab.click()
-                        time.sleep(1)
+                    tab = page.ele(strategy['tab'], timeout=5)
+                    if tab:
+                        # 切换标签后原来的上传控件会被替换，等它从 DOM 中移除即可
+                        old_input = page.ele(_SEL_UPLOAD, timeout=1)
+                        tab.click()
+                        if old_input:
+                            old_input.wait.deleted(timeout=1)
                 except:
                     pass
 
-            upload_input = page.ele('tag:input@type=file', timeout=10)
+            upload_input = page.ele(_SEL_UPLOAD, timeout=10)
             if not upload_input:
                 raise Exception("Upload input not found")
-                
+            
+            # 上传预览需要加载图片/视频，只保留第三方脚本的屏蔽
+            self._set_media_blocking(True, _THIRD_PARTY_BLOCKED_URLS)
             upload_input.input(files)
             
-            if publish_type == 'video':
-                page.wait.ele('text:重新上传', timeout=120)
-            else:
-                time.sleep(5)
+            # 视频上传开始后编辑表单就会出现，标题和正文在上传过程中填写；图片上传完成后才会出现标题输入框
+            page.wait.ele_displayed(_SEL_TITLE, timeout=30)
 
-            ele_title = page.ele('@@placeholder=填写标题')
+            ele_title = page.ele(_SEL_TITLE)
             if ele_title: ele_title.input(title)
             
-            ele_desc = page.ele('.ql-editor')
+            ele_desc = page.ele(_SEL_DESC)
             if ele_desc: ele_desc.input(desc)
+            
+            wait_sel, wait_timeout = strategy['wait_for']
+            deadline = time.time() + wait_timeout
+            try:
+                status = page.run_js(_SUBMIT_PUBLISH_JS, strategy['ready_text'], strategy['busy_text'],
+                                     wait_timeout * 1000, _UPLOAD_SETTLE_MS, timeout=wait_timeout + 5)
+            except Exception as e:
+                logger.warning("[%s] ⚠️ In-page publish submit failed, falling back: %s", self.user_id, e)
+                status = None
+                # 只等待剩余的时间，不在脚本已经等过之后再叠加一轮完整超时
+                page.wait.ele(wait_sel, timeout=max(deadline - time.time(), 1))
 
-            btn_publish = page.ele('text:发布', index=1)
-            if btn_publish:
+            if status == 'clicked':
+                logger.info("[%s] 🚀 Publish button clicked in page", self.user_id)
+            else:
+                if status == 'timeout':
+                    logger.warning("[%s] ⚠️ Upload not confirmed within %ss, trying publish anyway", self.user_id, wait_timeout)
+                btn_publish = page.ele(_SEL_PUBLISH, index=1, timeout=1)
+                if not btn_publish:
+                    return False, "Publish button not found"
                 btn_publish.click()
-                page.wait(3)
+
+            # 发布成功后会离开编辑页
+            if not page.wait.url_change('publish/publish', exclude=True, timeout=10):
+                return False, "Publish not confirmed: still on the publish page"
             
             return True, "Publish successful"
 
@@ -880,10 +1517,11 @@ class BrowserManager:
             return False, str(e)
             
         finally:
-            self.close()
-            for f in files:
-                if os.path.exists(f):
-                    try:
-                        os.remove(f)
-                    except:
-                        pass
+            # 浏览器由调用方交还 BrowserPool（清空登录态后复用）；临时文件在后台删除，不阻塞返回
+            IO_EXECUTOR.submit(_remove_files, list(files))
+
+    async def publish_content_async(self, cookies: Union[str, list], publish_type: str, files: list, title: str, desc: str, proxy_url: str = None, user_agent: str = None):
+        """publish_content 的异步版本，多个用户的发布任务可在同一进程内并发"""
+        return await asyncio.to_thread(
+            self.publish_content, cookies, publish_type, files, title, desc, proxy_url, user_agent
+        )
@@ -1,7 +1,31 @@
+import os
+import logging
 import time
+import socket
 import asyncio
+import tempfile
+import functools
+from collections import deque
 from typing import Dict, Optional
 from .browser import BrowserManager
+from .utils import move_to_trash
+
+logger = logging.getLogger(__name__)
+
+# Recycle a browser process after this many checkouts to bound leaks/bloat
+BROWSER_POOL_RECYCLE_AFTER = int(os.getenv("BROWSER_POOL_RECYCLE_AFTER", "100"))
+
+# Pooled browsers run from their own throwaway profiles here, so a browser can move between users
+BROWSER_POOL_PROFILE_ROOT = os.path.abspath("data/pool")
+
+# Hosts every login/publish talks to; resolving them at startup warms the system resolver cache
+XHS_HOSTS = ("creator.xiaohongshu.com", "www.xiaohongshu.com")
+
+
+@functools.lru_cache(maxsize=8)
+def _resolve(host: str):
+    return socket.getaddrinfo(host, 443)
+
 
 class BrowserPool:
     """
@@ -13,18 +37,92 @@ class BrowserPool:
     - Automatic cleanup of idle browsers
     """
     
-    def __init__(self, max_size: int = 3):
+    def __init__(self, max_size: int = 3, recycle_after: int = BROWSER_POOL_RECYCLE_AFTER):
         """
         Initialize browser pool.
         
         Args:
             max_size: Maximum number of concurrent browser instances (default: 3)
+            recycle_after: Replace a browser after this many checkouts (default: BROWSER_POOL_RECYCLE_AFTER)
         """
         self.max_size = max_size
-        self.available: list = []  # [(browser_manager, last_used_time), ...]
+        self.recycle_after = recycle_after
+        self.available: deque = deque()  # FIFO of (browser_manager, last_used_time)
         self.in_use: Dict[str, BrowserManager] = {}  # user_id -> browser_manager
         self.lock = asyncio.Lock()
-        print(f"🏊 Browser pool initialized with max_size={max_size}")
+        self.created_count = 0
+        self.recycled_count = 0
+        self._ready = asyncio.Event()
+        self._sweep_stale_profiles()
+        logger.info("🏊 Browser pool initialized with max_size=%s, recycle_after=%s", max_size, recycle_after)
+    
+    @staticmethod
+    def _sweep_stale_profiles():
+        """Profiles left in the pool root by a previous run belong to no live browser"""
+        os.makedirs(BROWSER_POOL_PROFILE_ROOT, exist_ok=True)
+        for entry in os.scandir(BROWSER_POOL_PROFILE_ROOT):
+            move_to_trash(entry.path)
+    
+    def _new_manager(self, user_id: str) -> BrowserManager:
+        self.created_count += 1
+        return BrowserManager(user_id, profile_dir=tempfile.mkdtemp(dir=BROWSER_POOL_PROFILE_ROOT))
+    
+    @staticmethod
+    def _dispose(manager: BrowserManager):
+        """Quit a browser for good and delete its pool profile (blocking; run in a worker thread)"""
+        try:
+            manager.close()
+        finally:
+            move_to_trash(manager.profile_dir)
+    
+    def stats(self) -> Dict[str, int]:
+        """Pool counters for metrics/monitoring"""
+        return {
+            "max_size": self.max_size,
+            "available": len(self.available),
+            "in_use": len(self.in_use),
+            "created": self.created_count,
+            "recycled": self.recycled_count,
+        }
+    
+    async def prewarm(self, count: Optional[int] = None):
+        """
+        Start browsers in the background and park them in the available pool,
+        so the first logins after boot get a warm start instead of a cold launch.
+        
+        Args:
+            count: Number of browsers to start (default: max_size)
+        """
+        count = self.max_size if count is None else min(count, self.max_size)
+        
+        async def warm_one(i: int):
+            manager = self._new_manager(f"_pool_{i}")
+            try:
+                await asyncio.to_thread(manager.start_browser, None, None, False)
+            except Exception as e:
+                logger.warning("⚠️  Failed to prewarm pool browser %s: %s", i, e)
+                await asyncio.to_thread(self._dispose, manager)
+                return
+            async with self.lock:
+                if len(self.available) + len(self.in_use) < self.max_size:
+                    self.available.append((manager, time.time()))
+                    return
+            # Real users filled the pool while this one was starting
+            await asyncio.to_thread(self._dispose, manager)
+        
+        try:
+            await asyncio.gather(
+                *(asyncio.to_thread(_resolve, host) for host in XHS_HOSTS),
+                return_exceptions=True
+            )
+            await asyncio.gather(*(warm_one(i) for i in range(count)))
+            logger.info("🔥 Browser pool prewarmed: %s available", len(self.available))
+        finally:
+            self._ready.set()
+    
+    async def ready(self):
+        """Wait until prewarm() has finished"""
+        await self._ready.wait()
     
     async def acquire(self, user_id: str, proxy_url: str = None, user_agent: str = None) -> BrowserManager:
         """
@@ -45,46 +143,56 @@ class BrowserPool:
         async with self.lock:
             # Check if user already has a browser in use
             if user_id in self.in_use:
-                print(f"[{user_id}] ♻️  Reusing existing browser from in_use pool")
+                logger.info("[%s] ♻️  Reusing existing browser from in_use pool", user_id)
                 return self.in_use[user_id]
             
-            # Try to get from available pool
-            if self.available:
-                manager, _ = self.available.pop(0)
-                print(f"[{user_id}] \u267b\ufe0f  Acquired browser from available pool (warm start)")
-                # Update user_id for this session
-                manager.user_id = user_id
-                # Update user_data_dir for security isolation
-                manager.user_data_dir = f"./user_data/{user_id}"
+            # Try to get from available pool (proxies are per process, so proxied sessions get their own browser)
+            while self.available and not proxy_url:
+                manager, _ = self.available.popleft()
+                
+                if manager.use_count >= self.recycle_after:
+                    # Worn-out browser: quit it and fall through to a fresh one
+                    logger.info("[%s] ♻️  Recycling browser after %s uses", manager.user_id, manager.use_count)
+                    self.recycled_count += 1
+                    await asyncio.to_thread(self._dispose, manager)
+                    continue
+                
+                logger.info("[%s] ♻️  Acquired browser from available pool (warm start)", user_id)
+                # Hand over to this user: switch user_data_dir and wipe the previous user's cookies/storage
+                await asyncio.to_thread(manager.assign_user, user_id)
+                manager.use_count += 1
                 self.in_use[user_id] = manager
                 return manager
             
             # Create new browser if under limit
             if len(self.in_use) < self.max_size:
-                print(f"[{user_id}] 🆕 Creating new browser instance ({len(self.in_use) + 1}/{self.max_size})")
-                manager = BrowserManager(user_id)
+                logger.info("[%s] 🆕 Creating new browser instance (%s/%s)", user_id, len(self.in_use) + 1, self.max_size)
+                manager = self._new_manager(user_id)
+                manager.use_count += 1
                 self.in_use[user_id] = manager
                 return manager
             
             # Pool is full - Evict oldest session (LRU/FIFO)
-            print(f"[{user_id}] ⚠️  Browser pool full ({self.max_size} browsers). Evicting oldest session...")
+            logger.warning("[%s] ⚠️  Browser pool full (%s browsers). Evicting oldest session...", user_id, self.max_size)
             
             # Get the first (oldest) user_id from in_use dict
             # Python 3.7+ dicts preserve insertion order, so first item is oldest
             oldest_user_id = next(iter(self.in_use))
             oldest_manager = self.in_use[oldest_user_id]
             
-            print(f"[{user_id}] 🚫 Evicting session: {oldest_user_id}")
+            logger.info("[%s] 🚫 Evicting session: %s", user_id, oldest_user_id)
+            # Quit in a worker thread: only the pool lock is held while Chromium shuts down, not the event loop
             try:
-                oldest_manager.close()
+                await asyncio.to_thread(self._dispose, oldest_manager)
             except Exception as e:
-                print(f"[{oldest_user_id}] ⚠️ Error closing evicted browser: {e}")
+                logger.warning("[%s] ⚠️ Error closing evicted browser: %s", oldest_user_id, e)
             
             del self.in_use[oldest_user_id]
             
             # Now create new browser for current user
-            print(f"[{user_id}] 🆕 Creating new browser instance after eviction")
-            manager = BrowserManager(user_id)
+            logger.info("[%s] 🆕 Creating new browser instance after eviction", user_id)
+            manager = self._new_manager(user_id)
+            manager.use_count += 1
             self.in_use[user_id] = manager
             return manager
     
@@ -92,71 +200,82 @@ class BrowserPool:
         """
         Release a browser back to the pool or close it.
         
+        A kept-alive browser is reset first (a logged-in user's cookies are saved to the
+        session store, then cookies/storage are wiped); one that can't be reset is closed.
+        
         Args:
             user_id: User identifier
-            keep_alive: If True, return to pool; if False, close browser
+            keep_alive: If True, reset and return to pool; if False, close browser
         """
         async with self.lock:
             if user_id not in self.in_use:
                 return
             
             manager = self.in_use.pop(user_id)
-            
-            if keep_alive and len(self.available) < self.max_size:
-                # Return to available pool with timestamp
-                print(f"[{user_id}] ↩️  Returning browser to available pool")
-                self.available.append((manager, time.time()))
-            else:
-                # Close browser
-                print(f"[{user_id}] 🔒 Closing browser")
-                try:
-                    manager.close()
-                except Exception as e:
-                    print(f"[{user_id}] ⚠️  Error closing browser: {e}")
+        
+        # Reset and close outside the lock so a slow browser doesn't stall other acquires
+        if keep_alive and await asyncio.to_thread(manager.reset_for_reuse):
+            async with self.lock:
+                if len(self.available) < self.max_size:
+                    # Return to available pool with timestamp
+                    logger.info("[%s] ↩️  Returning browser to available pool", user_id)
+                    self.available.append((manager, time.time()))
+                    return
+        
+        logger.info("[%s] 🔒 Closing browser", user_id)
+        try:
+            await asyncio.to_thread(self._dispose, manager)
+        except Exception as e:
+            logger.warning("[%s] ⚠️  Error closing browser: %s", user_id, e)
     
-    async def cleanup_idle(self, idle_timeout: int = 300):
+    async def cleanup_idle(self, idle_timeout: int = 300) -> Optional[float]:
         """
         Clean up browsers that have been idle for too long.
         
+        Browsers are appended to `available` as they are released, so the deque is
+        ordered by last use and only its expired head needs to be looked at.
+        
         Args:
             idle_timeout: Seconds of inactivity before cleanup (default: 300 = 5 minutes)
+            
+        Returns:
+            Seconds until the next idle browser expires, or None if none are idle
         """
         async with self.lock:
             current_time = time.time()
-            still_available = []
+            expired = []
             
-            for manager, last_used in self.available:
-                if current_time - last_used > idle_timeout:
-                    print(f"[{manager.user_id}] 🧹 Cleaning up idle browser (idle for {int(current_time - last_used)}s)")
-                    try:
-                        manager.close()
-                    except Exception as e:
-                        print(f"[{manager.user_id}] ⚠️  Error during idle cleanup: {e}")
-                else:
-                    still_available.append((manager, last_used))
+            while self.available and current_time - self.available[0][1] > idle_timeout:
+                manager, last_used = self.available.popleft()
+                logger.info("[%s] 🧹 Cleaning up idle browser (idle for %ss)", manager.user_id, int(current_time - last_used))
+                expired.append(manager)
             
-            self.available = still_available
-            print(f"🏊 Pool status: {len(self.available)} available, {len(self.in_use)} in use")
+            next_expiry = self.available[0][1] + idle_timeout - current_time if self.available else None
+            if expired:
+                logger.info("🏊 Pool status: %s available, %s in use", len(self.available), len(self.in_use))
+        
+        await self._close_managers(expired, "Error during idle cleanup")
+        return next_expiry
+    
+    async def _close_managers(self, managers: list, error_label: str):
+        """Close browsers in parallel worker threads (callers must not hold self.lock)"""
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self._dispose, manager) for manager in managers),
+            return_exceptions=True
+        )
+        for manager, result in zip(managers, results):
+            if isinstance(result, Exception):
+                logger.warning("[%s] ⚠️  %s: %s", manager.user_id, error_label, result)
     
     async def close_all(self):
         """Close all browsers in the pool (for shutdown)"""
         async with self.lock:
-            print("🔒 Closing all browsers in pool...")
-            
-            # Close available browsers
-            for manager, _ in self.available:
-                try:
-                    manager.close()
-                except:
-                    pass
-            
-            # Close in-use browsers
-            for manager in self.in_use.values():
-                try:
-                    manager.close()
-                except:
-                    pass
+            logger.info("🔒 Closing all browsers in pool...")
             
+            # Snapshot available and in-use browsers, then close them all at once
+            managers = [manager for manager, _ in self.available] + list(self.in_use.values())
             self.available.clear()
             self.in_use.clear()
-            print("✅ All browsers closed")
+        
+        await self._close_managers(managers, "Error closing browser")
+        logger.info("✅ All browsers closed")
@@ -0,0 +1,71 @@
+import os
+import logging
+from typing import Optional
+from .utils import load_json_file, save_json_file, json_loads, json_dumps
+
+logger = logging.getLogger(__name__)
+
+# redis is only needed when REDIS_URL is set; otherwise sessions stay in data/users/{user_id}/cookies.json
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Saved sessions expire from Redis after this many seconds (default: 7 days)
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+
+class SessionStore:
+    """
+    Saved login cookies per user.
+    
+    With REDIS_URL set, cookies live in Redis under sess:{user_id} with a TTL, so every
+    worker instance sees the same sessions and no per-user directory is needed.
+    Without it, they are kept in cookies.json inside the user's data directory.
+    """
+    
+    def __init__(self, users_root: str = "data/users", redis_url: Optional[str] = None, ttl: int = SESSION_TTL):
+        self.users_root = os.path.abspath(users_root)
+        self.ttl = ttl
+        self.redis = None
+        if redis_url:
+            if redis:
+                self.redis = redis.Redis.from_url(redis_url)
+                logger.info("🗄️ Session store backed by Redis (ttl=%ss)", ttl)
+            else:
+                logger.warning("⚠️ REDIS_URL is set but the redis package is not installed, using cookies.json files")
+    
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.users_root, user_id, "cookies.json")
+    
+    def load(self, user_id: str):
+        """Return the cookies as they were saved (list or dict), or None if the user has none"""
+        if self.redis:
+            payload = self.redis.get(f"sess:{user_id}")
+            return json_loads(payload) if payload else None
+        try:
+            return load_json_file(self._path(user_id))
+        except FileNotFoundError:
+            return None
+    
+    def save(self, user_id: str, cookies, indent: bool = False) -> None:
+        """Store the user's cookies, replacing any previous session"""
+        if self.redis:
+            self.redis.setex(f"sess:{user_id}", self.ttl, json_dumps(cookies))
+            return
+        path = self._path(user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_json_file(path, cookies, indent=indent)
+    
+    def delete(self, user_id: str) -> None:
+        """Forget the user's saved session so it is not restored into the next browser"""
+        if self.redis:
+            self.redis.delete(f"sess:{user_id}")
+            return
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+
+
+session_store = SessionStore(redis_url=os.getenv("REDIS_URL"))
@@ -1,129 +1,405 @@
 import os
+import json
+import queue
+import atexit
+import asyncio
+import logging
+import time
 import shutil
 import requests
-import uuid
-import glob
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger(__name__)
+
+# orjson is much faster for the cookies.json hot path; fall back to stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# aiohttp lets downloads run on the event loop instead of a thread each; optional
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# aiofiles keeps the chunk writes off the event loop; without it each chunk is written in a worker thread
+try:
+    import aiofiles
+except ImportError:
+    aiofiles = None
+
+
+def json_loads(data):
+    """Decode JSON bytes/str, using orjson when available"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def json_dumps(data, indent: bool = False) -> bytes:
+    """Encode to JSON bytes, using orjson when available"""
+    if orjson:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(data, option=option, default=str)
+    return json.dumps(data, indent=2 if indent else None, default=str).encode("utf-8")
+
+
+def load_json_file(path: str):
+    """Read a JSON file (cookies.json etc.), using orjson when available"""
+    with open(path, "rb") as f:
+        return json_loads(f.read())
+
+
+def save_json_file(path: str, data, indent: bool = False) -> None:
+    """Write a JSON file in binary mode, using orjson when available"""
+    payload = json_dumps(data, indent=indent)
+    with open(path, "wb") as f:
+        f.write(payload)
+
+
+def setup_queue_logging(level: int = logging.INFO) -> None:
+    """
+    Route root logging through a QueueHandler so that log calls only enqueue
+    and the actual stream writes happen on a background listener thread.
+    """
+    root = logging.getLogger()
+    if any(isinstance(h, QueueHandler) for h in root.handlers):
+        return
+    
+    handlers = root.handlers[:]
+    if not handlers:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter("%(message)s"))
+        handlers = [stream_handler]
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+    
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+# Shared session so repeated downloads reuse keep-alive connections and TLS sessions
+_HTTP_SESSION = requests.Session()
+# Range downloads and concurrent publishes open several connections to the same host
+_HTTP_SESSION.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_DOWNLOAD_CHUNK_SIZE = 1 << 20
+# Large files are fetched as parallel byte ranges when the server supports it
+_RANGE_PARTS = 4
+_RANGE_MIN_SIZE = 8 << 20
+
+
+def _range_size(status: int, headers):
+    """Return Content-Length from a HEAD response if the file is big enough to split and ranges are accepted, else None"""
+    if status != 200 or headers.get("Accept-Ranges") != "bytes" or "Content-Encoding" in headers:
+        return None
+    size = int(headers.get("Content-Length") or 0)
+    return size if size >= _RANGE_MIN_SIZE else None
+
+
+def _ranged_size(url: str):
+    """_range_size for url, probed with a HEAD request (None on network errors)"""
+    try:
+        r = _HTTP_SESSION.head(url, allow_redirects=True, timeout=10)
+    except requests.RequestException:
+        return None
+    return _range_size(r.status_code, r.headers)
+
+
+def _download_range(url: str, file_path: str, start: int, end: int) -> None:
+    """Write bytes [start, end] of url into the pre-sized file at the same offset"""
+    with _HTTP_SESSION.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise Exception(f"Range request not honored (HTTP {r.status_code})")
+        r.raw.decode_content = True
+        with open(file_path, "r+b") as f:
+            f.seek(start)
+            shutil.copyfileobj(r.raw, f, length=_DOWNLOAD_CHUNK_SIZE)
+
+
+def _temp_file_path(temp_dir: str, suffix: str) -> str:
+    """Random file path in temp_dir (created if missing); 64 random bits are plenty for a temp name"""
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, f"{os.urandom(8).hex()}{suffix}")
+
+
+def _preallocate(file_path: str, size: int) -> None:
+    """Create file_path at its final size so range parts can be written at their offsets"""
+    with open(file_path, 'wb') as f:
+        f.truncate(size)
+
+
+def _remove_partial(file_path: str) -> None:
+    """Delete what a failed download left behind"""
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
 
 def download_file(url: str, temp_dir: str = "/tmp", suffix: str = ".mp4") -> str:
     """
     Download file to temporary directory and return local path
     """
+    file_path = None
     try:
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-            
-        # Generate random filename
-        file_name = f"{uuid.uuid4()}{suffix}"
-        file_path = os.path.join(temp_dir, file_name)
+        file_path = _temp_file_path(temp_dir, suffix)
         
-        print(f"📥 Downloading file: {url}")
-        with requests.get(url, stream=True, timeout=60) as r:
-            r.raise_for_status()
-            with open(file_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        logger.info("📥 Downloading file: %s", url)
+        size = _ranged_size(url)
+        if size:
+            # Each connection fills its own slice; a single stream is capped by RTT on proxied links
+            _preallocate(file_path, size)
+            part = -(-size // _RANGE_PARTS)
+            with ThreadPoolExecutor(max_workers=_RANGE_PARTS) as pool:
+                futures = [
+                    pool.submit(_download_range, url, file_path, start, min(start + part, size) - 1)
+                    for start in range(0, size, part)
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            with _HTTP_SESSION.get(url, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                # Copy the raw stream in 1 MiB blocks instead of a Python-level chunk loop
+                r.raw.decode_content = True
+                with open(file_path, 'wb') as f:
+                    shutil.copyfileobj(r.raw, f, length=_DOWNLOAD_CHUNK_SIZE)
                     
-        print(f"✅ Download complete: {file_path}")
+        logger.info("✅ Download complete: %s", file_path)
         return file_path
     except Exception as e:
+        if file_path:
+            _remove_partial(file_path)
         raise Exception(f"File download failed: {str(e)}")
 
+
+# (event loop, ClientSession): a session is bound to the loop it was created on
+_aiohttp_session = None
+
+
+def _get_aiohttp_session():
+    """One ClientSession per event loop so connections and TLS sessions are reused across downloads"""
+    global _aiohttp_session
+    loop = asyncio.get_running_loop()
+    if _aiohttp_session is None or _aiohttp_session[0] is not loop or _aiohttp_session[1].closed:
+        session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60))
+        _aiohttp_session = (loop, session)
+    return _aiohttp_session[1]
+
+
+async def close_download_session() -> None:
+    """Close the shared aiohttp session; call from the app's shutdown hook"""
+    global _aiohttp_session
+    if _aiohttp_session is None:
+        return
+    loop, session = _aiohttp_session
+    _aiohttp_session = None
+    # A session from another (already finished) loop can't be closed from here
+    if loop is asyncio.get_running_loop() and not session.closed:
+        await session.close()
+
+
+async def _stream_to_file(r, file_path: str, mode: str, offset: int = 0) -> None:
+    """Write an aiohttp response body into file_path starting at offset, in 1 MiB chunks"""
+    if aiofiles:
+        async with aiofiles.open(file_path, mode) as f:
+            if offset:
+                await f.seek(offset)
+            async for chunk in r.content.iter_chunked(_DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+    else:
+        with open(file_path, mode) as f:
+            f.seek(offset)
+            async for chunk in r.content.iter_chunked(_DOWNLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(f.write, chunk)
+
+
+async def _ranged_size_async(session, url: str):
+    """Async _ranged_size on the shared aiohttp session"""
+    try:
+        async with session.head(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=10)) as r:
+            return _range_size(r.status, r.headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+
+
+async def _download_range_async(session, url: str, file_path: str, start: int, end: int) -> None:
+    """Async _download_range: write bytes [start, end] of url into the pre-sized file at the same offset"""
+    async with session.get(url, headers={"Range": f"bytes={start}-{end}"}) as r:
+        r.raise_for_status()
+        if r.status != 206:
+            raise Exception(f"Range request not honored (HTTP {r.status})")
+        await _stream_to_file(r, file_path, 'r+b', start)
+
+
+async def download_file_async(url: str, temp_dir: str = "/tmp", suffix: str = ".mp4") -> str:
+    """
+    Async download_file: streams with aiohttp on the event loop when installed (large files as
+    parallel byte ranges, like download_file), otherwise runs download_file in a worker thread
+    """
+    if aiohttp is None:
+        return await asyncio.to_thread(download_file, url, temp_dir, suffix)
+    file_path = None
+    try:
+        file_path = _temp_file_path(temp_dir, suffix)
+        session = _get_aiohttp_session()
+        
+        logger.info("📥 Downloading file: %s", url)
+        size = await _ranged_size_async(session, url)
+        if size:
+            # Each connection fills its own slice; a single stream is capped by RTT on proxied links
+            await asyncio.to_thread(_preallocate, file_path, size)
+            part = -(-size // _RANGE_PARTS)
+            parts = [
+                asyncio.ensure_future(_download_range_async(session, url, file_path, start, min(start + part, size) - 1))
+                for start in range(0, size, part)
+            ]
+            try:
+                await asyncio.gather(*parts)
+            except BaseException:
+                # Stop the other slices before the partial file is removed
+                for task in parts:
+                    task.cancel()
+                await asyncio.gather(*parts, return_exceptions=True)
+                raise
+        else:
+            async with session.get(url) as r:
+                r.raise_for_status()
+                await _stream_to_file(r, file_path, 'wb')
+        
+        logger.info("✅ Download complete: %s", file_path)
+        return file_path
+    except Exception as e:
+        if file_path:
+            _remove_partial(file_path)
+        raise Exception(f"File download failed: {str(e)}")
+
+
 def download_video(url: str, temp_dir: str = "/tmp") -> str:
     """Wrapper for backward compatibility"""
     return download_file(url, temp_dir, suffix=".mp4")
 
 
-def clean_all_user_data(users_base_dir: str, current_user_id: str = None) -> None:
+async def download_files_async(urls: list, suffixes: list, temp_dir: str = "/tmp") -> list:
     """
-    Clean all user data directories to ensure no session leakage.
-    
-    Args:
-        users_base_dir: Base directory containing all user data directories (e.g., "data/users")
-        current_user_id: Optional current user ID for logging purposes
+    Download several files concurrently and return local paths in input order.
+    If any download fails, the files that did succeed are removed and the first error is raised.
     """
-    if not os.path.exists(users_base_dir):
-        return
-        
-    log_prefix = f"[{current_user_id}] " if current_user_id else ""
-    print(f"{log_prefix}🧹 Cleaning ALL old user data directories...")
+    results = await asyncio.gather(
+        *(download_file_async(url, temp_dir, suffix) for url, suffix in zip(urls, suffixes)),
+        return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        for path in results:
+            if isinstance(path, str) and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        raise errors[0]
+    return list(results)
+
+
+def clean_user_data(users_base_dir: str, user_id: str) -> None:
+    """
+    Remove a single user's data directory (profile, saved cookies and UA).
     
-    for old_user_dir in os.listdir(users_base_dir):
-        old_path = os.path.join(users_base_dir, old_user_dir)
-        if os.path.isdir(old_path):
-            try:
-                shutil.rmtree(old_path)
-                print(f"{log_prefix}🗑️ Cleaned: {old_user_dir}")
-            except OSError as e:
-                print(f"{log_prefix}⚠️ Failed to clean {old_user_dir}: {e}")
+    Other users' directories are left alone: their browsers may be running from them.
+    """
+    try:
+        if move_to_trash(os.path.join(users_base_dir, user_id)):
+            logger.info("[%s] 🗑️ Cleaned user data directory", user_id)
+    except OSError as e:
+        logger.warning("[%s] ⚠️ Failed to clean user data directory: %s", user_id, e)
 
 
-def clean_all_chromium_data(user_id: str) -> int:
+# Shared background I/O pool: deletes trees that were renamed out of the way, temp files, etc.
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="io")
+
+# Prefix of directories renamed aside by move_to_trash and waiting to be deleted
+TRASH_PREFIX = ".trash-"
+
+
+def _fast_rmtree(path: str) -> None:
+    """
+    Delete a directory tree with os.scandir: files are unlinked straight from the cached
+    DirEntry and only real subdirectories are recursed into. Falls back to shutil.rmtree on error.
+    Entries that vanish while the walk is running (another deleter got there first) are skipped.
+    """
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        _fast_rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+        os.rmdir(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def move_to_trash(path: str) -> bool:
+    """
+    Remove a file, or rename a directory tree to a hidden sibling and delete it in the background.
+    The rename stays on the same filesystem, so it is a single inode operation. Returns False if the path did not exist.
+    """
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            parent, name = os.path.split(path.rstrip("/"))
+            trash = path
+            if not name.startswith(TRASH_PREFIX):
+                trash = os.path.join(parent, f"{TRASH_PREFIX}{name}-{time.monotonic_ns()}")
+                os.rename(path, trash)
+            IO_EXECUTOR.submit(_fast_rmtree, trash)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def sweep_trash(users_base_dir: str = "data/users") -> int:
     """
-    Clean ALL possible Chromium data storage locations.
-    This includes global config, cache, and temp files.
+    Delete trash directories left behind by a previous run that exited before its background deletes finished.
+    Looks in the users directory (removed user dirs) and every user profile (cleaned profile subdirectories).
     
-    Args:
-        user_id: User ID for logging purposes
-        
     Returns:
-        Number of locations cleaned
+        Number of trash directories queued for deletion
     """
-    dirs_to_clean = [
-        # User data directories
-        "/app/data/users",
-        "/src/data/users",
-        "data/users",
-        
-        # Chromium global config (root user in Docker)
-        "/root/.config/chromium",
-        "/root/.cache/chromium",
-        "/root/.local/share/chromium",
-        
-        # DrissionPage cache
-        "/root/.DrissionPage",
-    ]
-    
-    # Also check current user paths if not running as root
-    import getpass
-    if getpass.getuser() != 'root':
-        dirs_to_clean.extend([
-            os.path.expanduser("~/.config/chromium"),
-            os.path.expanduser("~/.cache/chromium"),
-            os.path.expanduser("~/.local/share/chromium"),
-            os.path.expanduser("~/.DrissionPage"),
-        ])
-    
-    # Glob patterns for Chromium temp files
-    glob_patterns = [
-        "/tmp/.org.chromium.Chromium*",
-        "/tmp/chromium*",
-        "/tmp/Temp-*",
-    ]
-    
-    cleaned_count = 0
-    
-    # Clean directories
-    for dir_path in dirs_to_clean:
-        if os.path.exists(dir_path):
-            try:
-                shutil.rmtree(dir_path)
-                print(f"[{user_id}] 🗑️ Cleaned directory: {dir_path}")
-                cleaned_count += 1
-            except Exception as e:
-                print(f"[{user_id}] ⚠️ Failed to clean {dir_path}: {e}")
+    users_base_dir = os.path.abspath(users_base_dir)
+    parents = [users_base_dir]
+    try:
+        with os.scandir(users_base_dir) as entries:
+            parents.extend(e.path for e in entries
+                           if e.is_dir(follow_symlinks=False) and not e.name.startswith(TRASH_PREFIX))
+    except OSError:
+        pass
     
-    # Clean glob patterns
-    for pattern in glob_patterns:
-        for path in glob.glob(pattern):
-            try:
-                if os.path.isdir(path):
-                    shutil.rmtree(path)
-                else:
-                    os.remove(path)
-                print(f"[{user_id}] 🗑️ Cleaned temp: {path}")
-                cleaned_count += 1
-            except Exception as e:
-                print(f"[{user_id}] ⚠️ Failed to clean {path}: {e}")
+    swept = 0
+    for parent in parents:
+        try:
+            with os.scandir(parent) as entries:
+                trash = [e.path for e in entries if e.name.startswith(TRASH_PREFIX)]
+        except OSError:
+            continue
+        for path in trash:
+            IO_EXECUTOR.submit(_fast_rmtree, path)
+        swept += len(trash)
     
-    print(f"[{user_id}] ✅ Cleaned {cleaned_count} Chromium data locations")
-    return cleaned_count
+    if swept:
+        logger.info("🧹 Deleting %s leftover trash directories in the background", swept)
+    return swept
@@ -1,4 +1,5 @@
 import asyncio
+import base64
 import os
 from dotenv import load_dotenv
 
@@ -8,8 +9,13 @@ from datetime import datetime
 from typing import Dict, Optional, List, Union
 from fastapi import FastAPI, BackgroundTasks, HTTPException, Header, WebSocket, WebSocketDisconnect, Body, Response
 from pydantic import BaseModel
-from core.browser import BrowserManager
-from core.utils import clean_all_user_data
+from core.utils import clean_user_data, close_download_session, setup_queue_logging, sweep_trash
+
+# Before the other core imports, so log lines emitted at import time (e.g. the session store backend) are kept
+setup_queue_logging()
+
+from core.browser_pool import BrowserPool
+from core.session_store import session_store
 from core.ai_agent import AutoContentManager
 
 from fastapi.staticfiles import StaticFiles
@@ -42,12 +48,42 @@ WORKER_SECRET = os.getenv("WORKER_SECRET", "default_secret_key")
 MAX_CONCURRENT_BROWSERS = asyncio.Semaphore(2)
 
 # === Session Management ===
-# Store active login sessions: user_id -> BrowserManager instance
-login_sessions: Dict[str, BrowserManager] = {}
+# Login and publish browsers are checked out of a persistent pool (user_id -> BrowserManager while in use)
+# so Chromium stays warm between tasks instead of being relaunched per call
+browser_pool = BrowserPool(max_size=int(os.getenv("BROWSER_POOL_SIZE", "3")))
+# Idle pooled browsers are quit after this many seconds to bound memory
+BROWSER_IDLE_TIMEOUT = int(os.getenv("BROWSER_IDLE_TIMEOUT", "600"))
 
 # Initialize AI Agent Manager
 auto_content_manager = AutoContentManager()
 
+@app.on_event("startup")
+async def startup_prewarm_browser():
+    """Warm the browser pool in the background so the first requests skip cold start"""
+    # Trash renamed aside by a previous run that exited mid-delete
+    await asyncio.to_thread(sweep_trash, os.path.abspath("data/users"))
+    asyncio.create_task(browser_pool.prewarm(int(os.getenv("BROWSER_POOL_PREWARM", str(browser_pool.max_size)))))
+    asyncio.create_task(reap_idle_browsers())
+
+async def reap_idle_browsers():
+    """Quit pooled browsers that have sat idle past BROWSER_IDLE_TIMEOUT, waking when the oldest one expires"""
+    delay = 60
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            next_expiry = await browser_pool.cleanup_idle(idle_timeout=BROWSER_IDLE_TIMEOUT)
+        except Exception as e:
+            print(f"⚠️ Idle browser cleanup failed: {e}")
+            next_expiry = None
+        # Nothing idle: a browser released from now on can't expire sooner than the timeout
+        delay = max(1.0, next_expiry if next_expiry is not None else BROWSER_IDLE_TIMEOUT)
+
+@app.on_event("shutdown")
+async def shutdown_browser_pool():
+    """Quit pooled browsers so no Chromium processes outlive the worker, and close the download session"""
+    await browser_pool.close_all()
+    await close_download_session()
+
 class PublishRequest(BaseModel):
     user_id: str
     cookies: Union[str, List[Dict]]
@@ -63,13 +99,13 @@ class LoginRequest(BaseModel):
     user_id: str
     proxy_url: Optional[str] = None
     user_agent: Optional[str] = None
-    force_fresh: bool = False  # Force fresh login, clean all old user data
+    force_fresh: bool = False  # Force fresh login, clean this user's old data
 
 async def background_publisher(data: PublishRequest):
     """Background task executor"""
     async with MAX_CONCURRENT_BROWSERS:
         print(f"🚦 Task processing started: User {data.user_id} | Type: {data.publish_type}")
-        browser = BrowserManager(data.user_id)
+        browser = await browser_pool.acquire(data.user_id, data.proxy_url, data.user_agent)
         
         # Prepare file list
         urls_to_download = []
@@ -78,25 +114,26 @@ async def background_publisher(data: PublishRequest):
         elif data.video_url:
             urls_to_download = [data.video_url]
             
-        # Download all files
-        from core.utils import download_file
+        # Download all files concurrently
+        from core.utils import download_files_async
+        suffixes = []
+        for url in urls_to_download:
+            suffix = ".mp4" if data.publish_type == "video" else ".jpg"
+            # Simple heuristic for extension
+            if ".png" in url.lower(): suffix = ".png"
+            if ".jpg" in url.lower() or ".jpeg" in url.lower(): suffix = ".jpg"
+            suffixes.append(suffix)
+        
         local_files = []
+        # Launch Chromium (or wake the pooled one) while the files download; publish_content reuses the live page
+        warmup = asyncio.create_task(
+            asyncio.to_thread(browser.start_browser, data.proxy_url, data.user_agent, False)
+        )
         try:
-            for url in urls_to_download:
-                suffix = ".mp4" if data.publish_type == "video" else ".jpg"
-                # Simple heuristic for extension
-                if ".png" in url.lower(): suffix = ".png"
-                if ".jpg" in url.lower() or ".jpeg" in url.lower(): suffix = ".jpg"
+            local_files = await download_files_async(urls_to_download, suffixes)
+            await asyncio.gather(warmup, return_exceptions=True)
                 
-                print(f"📥 Downloading file: {url}")
-                path = download_file(url, suffix=suffix)
-                print(f"✅ Download complete: {path}")
-                local_files.append(path)
-                
-            loop = asyncio.get_running_loop()
-            success, msg = await loop.run_in_executor(
-                None, 
-                browser.publish_content,
+            success, msg = await browser.publish_content_async(
                 data.cookies,
                 data.publish_type,
                 local_files,
@@ -106,8 +143,12 @@ async def background_publisher(data: PublishRequest):
                 data.user_agent
             )
             print(f"🏁 Task finished: User {data.user_id} | Result: {msg}")
+            # Hand the browser back; release wipes the published account's cookies before reuse
+            await browser_pool.release(data.user_id)
         except Exception as e:
             print(f"❌ Task failed: {e}")
+            await asyncio.gather(warmup, return_exceptions=True)
+            await browser_pool.release(data.user_id, keep_alive=False)
             # Cleanup if failed before browser cleanup
             for f in local_files:
                 if os.path.exists(f):
@@ -158,10 +199,7 @@ async def api_sync_cookie(
         f.write(req.ua)
         
     # Save Cookies
-    import json
-    cookie_path = f"{user_dir}/cookies.json"
-    with open(cookie_path, "w") as f:
-        json.dump(req.cookies, f)
+    await asyncio.to_thread(session_store.save, req.user_id, req.cookies)
     
     print(f"[{req.user_id}] ✅ Cookies saved successfully ({len(req.cookies)} cookies)")
     
@@ -204,10 +242,7 @@ async def api_sync_cookie_web(
         f.write(req.ua)
         
     # Save Cookies
-    import json
-    cookie_path = f"{user_dir}/cookies.json"
-    with open(cookie_path, "w") as f:
-        json.dump(req.cookies, f)
+    await asyncio.to_thread(session_store.save, req.user_id, req.cookies)
     
     print(f"[{req.user_id}] ✅ Cookies saved successfully (skipping browser verification - trusted source)")
     
@@ -254,9 +289,7 @@ async def sync_complete_cookies(
         "cookies": cookies
     }
     
-    cookie_path = f"{user_dir}/cookies.json"
-    with open(cookie_path, "w") as f:
-        json.dump(cookie_data, f, indent=2)
+    await asyncio.to_thread(session_store.save, user_id, cookie_data, indent=True)
     
     print(f"[{user_id}] ✅ Complete cookies saved successfully")
     print(f"[{user_id}] 📝 Cookie names: {[c['name'] for c in cookies[:10]]}")
@@ -269,67 +302,69 @@ async def sync_complete_cookies(
     }
 
 
-@app.post("/api/v1/login/qrcode")
-async def get_login_qrcode(
-    request: LoginRequest,
-    authorization: str = Header(None)
-):
-    """
-    Start a browser session and get the login QR code
-    """
-    if authorization != f"Bearer {WORKER_SECRET}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
-
-    # If force_fresh=True, clean all user data directories
+async def _fetch_login_qrcode(request: LoginRequest) -> dict:
+    """Check out a pooled browser for the user and return the QR result dict (base64 qr_image)"""
+    # Reuse the existing session's live browser unless a fresh one is forced.
+    # Releasing persists a logged-in user's cookies, so the user's data and saved session are dropped only
+    # afterwards. The released browser is reset (cookies/storage wiped) and stays in the pool.
+    # Only this user's directory is wiped: other users' browsers may be running from theirs.
     if request.force_fresh:
-        users_base_dir = os.path.abspath("data/users")
-        clean_all_user_data(users_base_dir, request.user_id)
-
-    # If there's an existing session for this user, close it first
-    if request.user_id in login_sessions:
-        try:
-            login_sessions[request.user_id].close()
-        except:
-            pass
-        del login_sessions[request.user_id]
+        await browser_pool.release(request.user_id)
+        await asyncio.to_thread(clean_user_data, os.path.abspath("data/users"), request.user_id)
+        await asyncio.to_thread(session_store.delete, request.user_id)
 
-    # Create new session
-    manager = BrowserManager(request.user_id)
-    login_sessions[request.user_id] = manager
+    manager = await browser_pool.acquire(request.user_id, request.proxy_url, request.user_agent)
     
-    # Run synchronous browser op in thread pool
-    loop = asyncio.get_running_loop()
     try:
         print(f"[{request.user_id}] 🚀 Requesting QR code...")
         result = await asyncio.wait_for(
-            loop.run_in_executor(
-                None,
-                manager.get_login_qrcode,
-                request.proxy_url,
-                request.user_agent
-            ),
+            manager.get_login_qrcode_async(request.proxy_url, request.user_agent, force=request.force_fresh),
             timeout=90.0
         )
         print(f"[{request.user_id}] ✅ QR code request completed: {result.get('status')}")
     except asyncio.TimeoutError:
         print(f"[{request.user_id}] ❌ QR code request timed out")
-        manager.close()
-        del login_sessions[request.user_id]
+        # The worker thread may still be driving this browser, so it is closed rather than reused
+        await browser_pool.release(request.user_id, keep_alive=False)
         raise HTTPException(status_code=504, detail="Browser initialization timed out")
     except Exception as e:
         print(f"[{request.user_id}] ❌ QR code request failed: {e}")
-        manager.close()
-        del login_sessions[request.user_id]
+        await browser_pool.release(request.user_id, keep_alive=False)
         raise HTTPException(status_code=500, detail=str(e))
     
     if result.get("status") == "error":
         # Cleanup on error
-        manager.close()
-        del login_sessions[request.user_id]
+        await browser_pool.release(request.user_id, keep_alive=False)
         raise HTTPException(status_code=500, detail=result.get("msg"))
         
     return result
 
+@app.post("/api/v1/login/qrcode")
+async def get_login_qrcode(
+    request: LoginRequest,
+    authorization: str = Header(None)
+):
+    """
+    Start a browser session and get the login QR code
+    """
+    if authorization != f"Bearer {WORKER_SECRET}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return await _fetch_login_qrcode(request)
+
+@app.post("/api/v1/login/qrcode.png")
+async def get_login_qrcode_png(
+    request: LoginRequest,
+    authorization: str = Header(None)
+):
+    """
+    Same as /api/v1/login/qrcode but returns the QR image as raw PNG bytes,
+    so clients that display or store the image skip the base64 inflation
+    """
+    if authorization != f"Bearer {WORKER_SECRET}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    result = await _fetch_login_qrcode(request)
+    return Response(content=base64.b64decode(result["qr_image"]), media_type="image/png")
+
 @app.get("/api/v1/login/status/{user_id}")
 async def check_login_status(
     user_id: str,
@@ -341,22 +376,20 @@ async def check_login_status(
     if authorization != f"Bearer {WORKER_SECRET}":
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    if user_id not in login_sessions:
+    manager = browser_pool.in_use.get(user_id)
+    if not manager:
         raise HTTPException(status_code=404, detail="Session not found. Please request QR code first.")
-
-    manager = login_sessions[user_id]
     
     loop = asyncio.get_running_loop()
-    is_logged_in = await loop.run_in_executor(None, manager.check_login_status)
+    is_logged_in = await manager.check_login_status_async()
     
     if is_logged_in:
         # Login successful! 
         # Get cookies before closing the browser
         cookies = await loop.run_in_executor(None, manager.get_cookies)
         
-        # Cleanup the browser session as it's no longer needed for interaction
-        manager.close()
-        del login_sessions[user_id]
+        # Hand the browser back to the pool; release saves the session, then wipes its cookies/storage
+        await browser_pool.release(user_id)
         
         if cookies:
             return {
@@ -381,20 +414,9 @@ async def check_login_status_web(user_id: str):
     Check if user is logged in using saved cookies
     Protected by CORS - only allowed origins can call this
     """
-    import json
-    
-    user_dir = os.path.abspath(f"data/users/{user_id}")
-    cookie_path = f"{user_dir}/cookies.json"
-    
-    # Check if cookies exist
-    if not os.path.exists(cookie_path):
-        print(f"[{user_id}] ❌ No cookies found")
-        return {"status": "not_logged_in", "is_logged_in": False, "message": "No cookies found"}
-    
     try:
         # Load cookies
-        with open(cookie_path, "r") as f:
-            cookies = json.load(f)
+        cookies = await asyncio.to_thread(session_store.load, user_id)
         
         if not cookies or len(cookies) == 0:
             return {"status": "not_logged_in", "is_logged_in": False, "message": "No cookies found"}
@@ -423,29 +445,33 @@ async def close_session(
     authorization: str = Header(None)
 ):
     """
-    Close the browser session and clean up ALL user data
+    Close the browser session and clean up the user's data
     """
     if authorization != f"Bearer {WORKER_SECRET}":
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-    # Close active session if exists
-    if user_id in login_sessions:
-        try:
-            login_sessions[user_id].close()
-        except:
-            pass
-        del login_sessions[user_id]
+    # Release the active session if any (its browser is wiped and pooled; a logged-in session is persisted
+    # on the way), then drop the saved session so it is not re-injected into the user's next browser
+    await browser_pool.release(user_id)
+    await asyncio.to_thread(session_store.delete, user_id)
 
-    # Clean up ALL user data directories to ensure no session leakage
+    # Clean up this user's data directory; other users' browsers may be running from theirs
     users_base_dir = os.path.abspath("data/users")
-    clean_all_user_data(users_base_dir, user_id)
+    await asyncio.to_thread(clean_user_data, users_base_dir, user_id)
 
-    return {"status": "success", "message": "Session closed and ALL user data cleaned"}
+    return {"status": "success", "message": "Session closed and user data cleaned"}
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+@app.get("/api/v1/browser/pool")
+async def browser_pool_stats(authorization: str = Header(None)):
+    """Browser pool counters (warm/in-use/created/recycled)"""
+    if authorization != f"Bearer {WORKER_SECRET}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return browser_pool.stats()
+
 # === Configuration Endpoints ===
 
 @app.get("/api/v1/config/supabase")
@@ -697,15 +723,10 @@ async def approve_task(
     # In a real scenario, we should load them from the user's session file.
     # For now, we'll assume the user is logged in and we can get cookies from the file system.
     
-    user_dir = os.path.abspath(f"data/users/{user_id}")
-    cookie_path = f"{user_dir}/cookies.json"
-    
-    if not os.path.exists(cookie_path):
+    cookies = await asyncio.to_thread(session_store.load, user_id)
+    if not cookies:
         raise HTTPException(status_code=400, detail="User not logged in. Please login first.")
         
-    with open(cookie_path, 'r') as f:
-        cookies = json.load(f)
-        
     # Reuse the existing background_publisher logic
     publish_req = PublishRequest(
         user_id=user_id,
@@ -738,18 +759,12 @@ async def get_xhs_profile_and_sync(
     This is called by the frontend after login to register the account
     """
     # 1. Load Cookies
-    user_dir = os.path.abspath(f"data/users/{userId}")
-    cookie_path = f"{user_dir}/cookies.json"
-    
-    if not os.path.exists(cookie_path):
-        raise HTTPException(status_code=401, detail="No cookies found. Please login first.")
-        
     try:
-        import json
-        with open(cookie_path, "r") as f:
-            cookies = json.load(f)
+        cookies = await asyncio.to_thread(session_store.load, userId)
     except:
         raise HTTPException(status_code=401, detail="Invalid cookie file.")
+    if not cookies:
+        raise HTTPException(status_code=401, detail="No cookies found. Please login first.")
         
     # 2. Extract web_session for hash
     web_session = next((c['value'] for c in cookies if c['name'] == 'web_session'), None)
@@ -764,8 +779,9 @@ async def get_xhs_profile_and_sync(
     # Format cookies for requests
     cookie_dict = {c['name']: c['value'] for c in cookies}
     
-    # Load UA from file if exists
-    ua_path = f"{user_dir}/ua.txt"
+    # Load UA from file if exists (ua.txt stays in the user's directory; cookies come from the session store)
+    ua = None
+    ua_path = os.path.abspath(f"data/users/{userId}/ua.txt")
     if os.path.exists(ua_path):
         with open(ua_path, "r") as f:
             ua = f.read().strip()
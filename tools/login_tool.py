@@ -27,9 +27,17 @@ class LoginTool:
         self.backend_url = backend_url.rstrip('/')
         self.worker_secret = worker_secret or os.getenv('WORKER_SECRET', '')
         self.page = None
+        # 设置 DEBUG_BROWSER_PORT 时连接已在运行的浏览器，反复调试时不必每次冷启动
+        self.attach_port = os.getenv('DEBUG_BROWSER_PORT')
         
     def start_browser(self):
         """启动可见浏览器"""
+        if self.attach_port:
+            print(f"🔌 正在连接已运行的浏览器 (127.0.0.1:{self.attach_port})...")
+            self.page = ChromiumPage(addr_or_opts=f"127.0.0.1:{self.attach_port}")
+            print("✅ 已连接浏览器")
+            return
+        
         print("🚀 正在启动浏览器...")
         
         co = ChromiumOptions()
@@ -45,7 +53,7 @@ class LoginTool:
         """导航到登录页面"""
         print("🌐 正在打开小红书创作者平台...")
         self.page.get("https://creator.xiaohongshu.com/login")
-        time.sleep(3)
+        self.page.wait.doc_loaded(timeout=10)
         print("✅ 登录页面已打开")
         
     def wait_for_login(self, timeout=300):
@@ -81,7 +89,13 @@ class LoginTool:
             remaining = timeout - elapsed
             print(f"\r⏳ 等待登录中... ({elapsed}s / {timeout}s)", end='', flush=True)
             
-            time.sleep(2)
+            # 登录成功会跳离登录页，URL 一变化就立即进入下一轮检查；
+            # 当前 URL 本来就不含 login 时 url_change 会立即返回，补足间隔避免空转
+            wait_start = time.time()
+            self.page.wait.url_change('login', exclude=True, timeout=2)
+            idle = 2 - (time.time() - wait_start)
+            if idle > 0 and 'login' not in self.page.url:
+                time.sleep(idle)
         
         print("\n\n❌ 登录超时！请重新运行工具。")
         return False
@@ -153,6 +167,10 @@ class LoginTool:
     
     def cleanup(self):
         """清理浏览器"""
+        if self.page and self.attach_port:
+            # 连接的是外部浏览器，保留进程供下次调试使用
+            print("\n🔌 已断开浏览器（保持运行）")
+            return
         if self.page:
             print("\n🧹 正在关闭浏览器...")
             try:
@@ -215,6 +233,7 @@ def main():
     
 环境变量:
     WORKER_SECRET - 后端认证密钥（可选，也可以在后端环境变量中配置）
+    DEBUG_BROWSER_PORT - 连接该调试端口上已运行的浏览器，而不是新启动一个（可选）
         """
     )
     